@@ -3,8 +3,11 @@
 Contains code for the app chooser.
 """
 from gi.repository import Gdk, Gio, GLib, GObject, Gtk, GdkPixbuf
+import os
+import threading
 
 from ..config import config
+from ..utils.decoder import decoder_pool
 
 # Used by AppIcon to find the app chooser revealer
 app_chooser = None
@@ -16,6 +19,27 @@ def app_info_to_filenames(appinfo):
         output[app.get_property("filename")] = app
     return output
 
+def load_icon_pixbuf(icon_files):
+    """
+    Loads the first of the given icon files that can be loaded at 96x96,
+    in a decoder worker process if out-of-process decoding is enabled.
+    Returns None if none of the files can be loaded.
+    """
+    for icon_file in icon_files:
+        if decoder_pool.enabled:
+            # Don't send requests to the workers for missing files
+            if not os.path.exists(icon_file):
+                continue
+            pixbuf, icon_size = decoder_pool.decode(icon_file, 96, 96, 1, upscale=True)
+            if pixbuf:
+                return pixbuf
+        else:
+            try:
+                return GdkPixbuf.Pixbuf.new_from_file_at_scale(icon_file, 96, 96, True)
+            except GLib.GError:
+                continue
+    return None
+
 @Gtk.Template(resource_path='/org/dithernet/aspinwall/launcher/ui/appicon.ui')
 class AppIcon(Gtk.Box):
     """Contains an app icon for the app chooser."""
@@ -29,6 +53,7 @@ class AppIcon(Gtk.Box):
     appicon_notfav_menu = Gtk.Template.Child()
 
     actions_installed = False
+    _icon_generation = 0
 
     def __init__(self):
         """Initializes an AppIcon."""
@@ -113,49 +138,52 @@ class AppIcon(Gtk.Box):
         # where some SVGs would completely fail to load, segfaulting the entire
         # program. This is a lazy fix that loads the icons manually in most cases,
         # which should hopefully be enough to work around the issue.
-        icon_found = False
         icon_name = value.to_string()
+        self._icon_generation += 1
         if '/' in icon_name:
-            try:
-                self.app_icon.set_from_pixbuf(
-                    GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                        icon_name, 96, 96, True
-                    )
-                )
-            except GLib.GError:
-                pass
-            else:
-                icon_found = True
+            icon_files = [icon_name]
         elif '.' not in icon_name:
             self.app_icon.set_from_icon_name(icon_name)
-            icon_found = True
+            return
         else:
             icon_paths = Gtk.IconTheme.get_for_display(self.get_display()).get_search_path()
-            for path in ['/usr/share/icons/hicolor/scalable/apps'] + icon_paths:
-                try:
-                    self.app_icon.set_from_pixbuf(
-                        GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                            path + '/' + icon_name + '.svg', 96, 96, True
-                        )
-                    )
-                except GLib.GError:
-                    try:
-                        self.app_icon.set_from_pixbuf(
-                            GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                                path + '/' + icon_name + '.png', 96, 96, True
-                            )
-                        )
-                    except GLib.GError:
-                        continue
-                    else:
-                        icon_found = True
-                        break
-                else:
-                    icon_found = True
-                    break
+            icon_files = [
+                path + '/' + icon_name + extension
+                for path in ['/usr/share/icons/hicolor/scalable/apps'] + icon_paths
+                for extension in ('.svg', '.png')
+            ]
+
+        if decoder_pool.enabled:
+            # Icons decoded in worker processes are loaded in a separate
+            # thread, so that the main thread never waits for a worker
+            self.app_icon.clear()
+            icon_thread = threading.Thread(
+                target=self._load_icon,
+                args=[icon_files, icon_name, self._icon_generation],
+                daemon=True
+            )
+            icon_thread.start()
+        else:
+            self.set_icon_pixbuf(load_icon_pixbuf(icon_files), icon_name, self._icon_generation)
+
+    def _load_icon(self, icon_files, icon_name, generation):
+        """Loads the app icon; runs in the icon loading thread."""
+        GLib.idle_add(
+            self.set_icon_pixbuf, load_icon_pixbuf(icon_files), icon_name, generation
+        )
 
-        if not icon_found:
+    def set_icon_pixbuf(self, pixbuf, icon_name, generation):
+        """
+        Shows the loaded icon, or the icon with the given name from the icon
+        theme if it couldn't be loaded, unless the icon was changed since.
+        """
+        if generation != self._icon_generation:
+            return False
+        if pixbuf:
+            self.app_icon.set_from_pixbuf(pixbuf)
+        else:
             self.app_icon.set_from_icon_name(icon_name)
+        return False
 
     @GObject.Property(type=str)
     def icon_name(self):
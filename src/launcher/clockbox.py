@@ -1,13 +1,12 @@
 # coding: utf-8
 """
-Contains code for the ClockBox. The clock refresh is handled by the clock
-daemon (utils/clock.py).
+Contains code for the ClockBox. The clock refresh is handled by the time
+formatter (utils/clock.py).
 """
 from gi.repository import Gtk
-import time
 
 from ..config import config
-from ..utils.clock import clock_daemon
+from ..utils.clock import time_formatter
 from ..utils.dimmable import Dimmable
 
 @Gtk.Template(resource_path='/org/dithernet/aspinwall/launcher/ui/clockbox.ui')
@@ -22,12 +21,14 @@ class ClockBox(Gtk.Box, Dimmable):
     def __init__(self):
         """Initializes the clock box."""
         super().__init__()
+        self.watches = []
         self.update_size()
-        self.update()
+        self.update_formats()
         self.toggle_ampm()
         config.connect('changed::clock-size', self.update_size)
         config.connect('changed::clock-ampm', self.toggle_ampm)
-        clock_daemon.connect('notify::time', self.update)
+        config.connect('changed::time-format', self.update_formats)
+        config.connect('changed::date-format', self.update_formats)
 
     def update_size(self, *args):
         """Updates the size of the clock based on the clock-size config."""
@@ -45,11 +46,29 @@ class ClockBox(Gtk.Box, Dimmable):
             self.remove_css_class('small')
             self.remove_css_class('medium')
 
+    def update_formats(self, *args):
+        """
+        Reads the time and date formats from the config and watches them
+        for changes, then updates the clock.
+        """
+        for watch_id in self.watches:
+            time_formatter.unwatch(watch_id)
+
+        self.time_format = config['time-format']
+        self.date_format = config['date-format']
+        # Labels are only updated when their text changes
+        self.watches = [
+            time_formatter.watch(self.time_format, self.clockbox_time.set_label, owner=self),
+            time_formatter.watch(self.date_format, self.clockbox_date.set_label, owner=self),
+            time_formatter.watch('%p', self.clockbox_ampm.set_label, owner=self)
+        ]
+        self.update()
+
     def update(self, *args):
         """Updates the time and date on the clock."""
-        self.clockbox_time.set_label(time.strftime(config['time-format']))
-        self.clockbox_date.set_label(time.strftime(config['date-format']))
-        self.clockbox_ampm.set_label(time.strftime('%p'))
+        self.clockbox_time.set_label(time_formatter.format(self.time_format))
+        self.clockbox_date.set_label(time_formatter.format(self.date_format))
+        self.clockbox_ampm.set_label(time_formatter.format('%p'))
 
     def toggle_ampm(self, *args):
         """Shows/hides the AM/PM indicator based on the config value."""
@@ -3,10 +3,11 @@
 Contains code for the launcher settings window. Not to be confused with the
 settings access backend, which is set up in config.py.
 """
-from gi.repository import Adw, GdkPixbuf, Gtk, Gdk, Gio, GObject, GLib
+from gi.repository import Adw, Gtk, Gdk, Gio, GObject, GLib
 import threading
 
 from ..config import config
+from .wallpaper import load_image
 
 @Gtk.Template(resource_path='/org/dithernet/aspinwall/launcher/ui/wallpapericon.ui')
 class WallpaperIcon(Gtk.FlowBoxChild):
@@ -43,10 +44,7 @@ class WallpaperIcon(Gtk.FlowBoxChild):
         """Binds the wallpaper icon to a wallpaper from the path."""
         self.wallpaper = wallpaper_path
 
-        self.pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(
-            wallpaper_path,
-            144, 144
-        )
+        self.pixbuf, image_size = load_image(wallpaper_path, 144, 144, 1)
 
         GLib.idle_add(lambda *args: self.picture.set_pixbuf(self.pixbuf))
 
@@ -92,6 +90,7 @@ class LauncherSettings(Adw.PreferencesWindow):
     wallpaper_color_button = Gtk.Template.Child()
     slideshow_mode_toggle = Gtk.Template.Child()
     slideshow_switch_delay_combobox = Gtk.Template.Child()
+    slideshow_order_combobox = Gtk.Template.Child()
     slideshow_switch_length_spinbutton = Gtk.Template.Child()
 
     theme_toggle_start = Gtk.Template.Child()
@@ -119,7 +118,8 @@ class LauncherSettings(Adw.PreferencesWindow):
         super().__init__()
 
         self.wallpaper_image_filter = Gtk.FileFilter()
-        for mime in ('image/png', 'image/jpeg', 'image/jpg'):
+        for mime in ('image/png', 'image/jpeg', 'image/jpg', 'image/webp', 'image/avif',
+                     'image/svg+xml'):
             self.wallpaper_image_filter.add_mime_type(mime)
 
         # Set up settings
@@ -167,6 +167,9 @@ class LauncherSettings(Adw.PreferencesWindow):
         config.bind('slideshow-mode', self.slideshow_mode_toggle, 'active',
             Gio.SettingsBindFlags.DEFAULT
         )
+        config.bind('slideshow-order', self.slideshow_order_combobox, 'selected',
+            Gio.SettingsBindFlags.DEFAULT
+        )
         config.bind('clock-size', self.clock_size_combobox, 'selected',
             Gio.SettingsBindFlags.DEFAULT
         )
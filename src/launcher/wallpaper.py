@@ -2,96 +2,847 @@
 """
 Contains code for handling wallpapers
 """
-from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, GObject
+from gi.repository import Adw, Gtk, Gdk, GdkPixbuf, Gio, GLib, GObject, Graphene
 import math
 import os
+import struct
+import threading
+import time
 import traceback
 
 from ..config import config
 from ..utils.clock import clock_daemon
+from ..utils.decoder import decoder_pool, get_decode_size
 from ..utils.dimmable import Dimmable
+from ..utils.mappedfile import mapped_files
+from ..utils.slideshow import SlideshowPlaylist
+from ..utils.wallpapercache import wallpaper_cache, wallpaper_memory_cache
+from ..utils.wallpaperspan import get_monitor_span, get_span_crop, get_span_source_size
 
-def color_to_pixel(color):
-    """Turns RGB color value to pixel value."""
-    red = color[0]
-    green = color[1]
-    blue = color[2]
-    alpha = 0
-    if len(color) == 4:
-        alpha = color[3]
-    return ((((red)) << 24) |    # noqa: W504
-            (((green)) << 16) |  # noqa: W504
-            (((blue)) << 8) |    # noqa: W504
-            ((alpha)))           # noqa: W504
+def color_to_rgba(color):
+    """Turns an RGB color value (0-255 per channel) into an opaque Gdk.RGBA."""
+    rgba = Gdk.RGBA()
+    rgba.red = color[0] / 255
+    rgba.green = color[1] / 255
+    rgba.blue = color[2] / 255
+    rgba.alpha = 1
+    return rgba
+
+# Wallpaper style that spans one image across all monitors
+STYLE_SPAN = 3
+
+# Amount of bytes fed to the image loader at once; loading can be
+# cancelled between chunks
+READ_CHUNK_SIZE = 1048576
+# Amount of bytes scanned for JPEG markers and EXIF thumbnails
+JPEG_HEADER_SIZE = 131072
+
+def get_exif_thumbnail_range(header, start, length):
+    """
+    Returns the offset and length of the thumbnail embedded in the EXIF
+    segment at the given position of a JPEG header, or None if there is
+    no thumbnail.
+    """
+    exif = header[start:start + length]
+    if exif[:6] != b'Exif\0\0':
+        return None
+    tiff = exif[6:]
+    if tiff[:2] == b'II':
+        byte_order = '<'
+    elif tiff[:2] == b'MM':
+        byte_order = '>'
+    else:
+        return None
+
+    thumbnail_offset = 0
+    thumbnail_length = 0
+    try:
+        # The thumbnail is described by the second IFD
+        ifd_offset = struct.unpack_from(byte_order + 'I', tiff, 4)[0]
+        entry_count = struct.unpack_from(byte_order + 'H', tiff, ifd_offset)[0]
+        ifd_offset = struct.unpack_from(
+            byte_order + 'I', tiff, ifd_offset + 2 + entry_count * 12
+        )[0]
+        if not ifd_offset:
+            return None
+        entry_count = struct.unpack_from(byte_order + 'H', tiff, ifd_offset)[0]
+        for i in range(entry_count):
+            tag, value_type, count, value = struct.unpack_from(
+                byte_order + 'HHII', tiff, ifd_offset + 2 + i * 12
+            )
+            if tag == 0x0201:
+                thumbnail_offset = value
+            elif tag == 0x0202:
+                thumbnail_length = value
+    except struct.error:
+        return None
+
+    if not thumbnail_offset or not thumbnail_length or \
+            thumbnail_offset + thumbnail_length > len(tiff):
+        return None
+    return (start + 6 + thumbnail_offset, thumbnail_length)
+
+def parse_jpeg_header(header):
+    """
+    Scans the markers at the start of a JPEG file. Returns a tuple containing
+    whether the image is progressive and the offset and length of its EXIF
+    thumbnail (or None). Returns (False, None) for other file formats.
+    """
+    if header[:2] != b'\xff\xd8':
+        return (False, None)
+
+    thumbnail = None
+    offset = 2
+    while offset + 4 <= len(header) and header[offset] == 0xff:
+        marker = header[offset + 1]
+        if marker == 0xff:
+            # Fill byte
+            offset += 1
+            continue
+        length = struct.unpack_from('>H', header, offset + 2)[0]
+        if marker == 0xe1 and not thumbnail:
+            thumbnail = get_exif_thumbnail_range(header, offset + 4, length - 2)
+        elif marker in (0xc2, 0xc6, 0xca, 0xce):
+            return (True, thumbnail)
+        elif 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc) or marker == 0xda:
+            # Start of a non-progressive frame, or of the image data
+            break
+        offset += 2 + length
+
+    return (False, thumbnail)
+
+def load_thumbnail(data, offset, length):
+    """Decodes the embedded thumbnail at the given range of the image data."""
+    loader = GdkPixbuf.PixbufLoader()
+    try:
+        loader.write_bytes(GLib.Bytes.new_from_bytes(data, offset, length))
+        loader.close()
+    except GLib.GError:
+        return None
+    return loader.get_pixbuf()
+
+def load_image(wallpaper_path, width=0, height=0, style=2, is_preview=False, cancellable=None,
+               on_preview=None):
+    """
+    Loads the wallpaper image from the given path, decoded directly at
+    the size needed to cover a width x height area in the given style
+    (see get_decode_size), so that the full-size image is never kept in
+    memory. The file is read through a shared memory mapping, and slices
+    of the mapping are streamed to the decoder without copying them.
+
+    If on_preview is set, it's called (from the calling thread) with
+    lower resolution versions of the image as they become available:
+    the thumbnail embedded in the EXIF data of JPEG files, and the first
+    pass of progressive JPEGs.
+
+    Returns a tuple containing the image and its original size, or
+    (None, None) if the path is unset, the wallpaper style doesn't use
+    the image, the image can't be loaded or loading was cancelled through
+    the provided Gio.Cancellable.
+    """
+    if style == 0:
+        return (None, None)
+    if not wallpaper_path or wallpaper_path == '/' or not os.path.exists(wallpaper_path):
+        return (None, None)
+
+    if is_preview and (width <= 0 or height <= 0):
+        # The settings preview has a set size of 240x135
+        width = 240
+        height = 135
+
+    if decoder_pool.enabled:
+        if cancellable and cancellable.is_cancelled():
+            return (None, None)
+        return decoder_pool.decode(wallpaper_path, width, height, style)
+
+    original_size = []
+    progressive = False
+
+    def on_size_prepared(loader, src_width, src_height):
+        """Sets the size to decode the image at, based on the header."""
+        original_size.extend((src_width, src_height))
+        loader.set_size(*get_decode_size(src_width, src_height, width, height, style))
+
+    def on_area_updated(loader, x, y, area_width, area_height):
+        """Passes on the first complete pass of progressive images."""
+        nonlocal progressive
+        pixbuf = loader.get_pixbuf()
+        if progressive and y + area_height >= pixbuf.get_height():
+            progressive = False
+            on_preview(pixbuf.copy())
+
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', on_size_prepared)
+    try:
+        data = mapped_files.get_bytes(wallpaper_path)
+        size = data.get_size()
+
+        if on_preview:
+            header = GLib.Bytes.new_from_bytes(data, 0, min(size, JPEG_HEADER_SIZE)).get_data()
+            progressive, thumbnail_range = parse_jpeg_header(header)
+            if thumbnail_range:
+                thumbnail = load_thumbnail(data, *thumbnail_range)
+                if thumbnail:
+                    on_preview(thumbnail)
+            if progressive:
+                loader.connect('area-updated', on_area_updated)
+
+        offset = 0
+        while offset < size:
+            if cancellable:
+                cancellable.set_error_if_cancelled()
+            length = min(READ_CHUNK_SIZE, size - offset)
+            loader.write_bytes(GLib.Bytes.new_from_bytes(data, offset, length))
+            offset += length
+        loader.close()
+    except GLib.GError as e:
+        try:
+            loader.close()
+        except GLib.GError:
+            pass
+        if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+            traceback.print_exc()
+        return (None, None)
+
+    return (loader.get_pixbuf(), tuple(original_size))
+
+def load_wallpaper(wallpaper_path, width, height, style, is_preview=False, span=None,
+                   cancellable=None, on_preview=None):
+    """
+    Loads the wallpaper and renders it for a width x height area in the
+    given style. Goes through the shared in-memory cache first, so that
+    every variant of a wallpaper is only loaded once, then through the
+    on-disk cache. Doesn't touch any widgets, so it can be called from
+    other threads. on_preview is passed on to load_image if the image
+    has to be decoded.
+
+    Spanned wallpapers are cropped from a single image shared by all
+    monitors, as described by span (see Wallpaper.get_span).
+
+    Returns a tuple containing the decoded image (None if the wallpaper
+    came from the on-disk cache), the original size of the image and the
+    rendered texture.
+    """
+    return wallpaper_memory_cache.get(
+        wallpaper_memory_cache.get_key(wallpaper_path, width, height, style, is_preview, span),
+        lambda: load_wallpaper_uncached(
+            wallpaper_path, width, height, style, is_preview, span, cancellable, on_preview
+        )
+    )
+
+def load_wallpaper_uncached(wallpaper_path, width, height, style, is_preview=False, span=None,
+                            cancellable=None, on_preview=None):
+    """Loads the wallpaper like load_wallpaper, but skips the in-memory cache."""
+    cache_key = None
+    if wallpaper_path and style != 0 and width > 0 and height > 0:
+        cache_key = wallpaper_cache.get_key(wallpaper_path, width, height, style, span)
+        cached = wallpaper_cache.lookup(cache_key)
+        if cached:
+            texture, image_size = cached
+            return (None, image_size, texture)
+
+    if style == STYLE_SPAN and span:
+        image, image_size = load_span_source(wallpaper_path, span, cancellable)
+    else:
+        image, image_size = load_image(
+            wallpaper_path, width, height, style, is_preview, cancellable, on_preview
+        )
+    if cancellable and cancellable.is_cancelled():
+        return (None, None, None)
+
+    pixbuf = render_wallpaper(image, style, width, height, span)
+    wallpaper_cache.store(cache_key, pixbuf, image_size)
+    return (image, image_size, texture_for_pixbuf(pixbuf))
+
+def load_span_source(wallpaper_path, span, cancellable=None):
+    """
+    Returns a tuple containing the image shared by all monitors a wallpaper
+    is spanned across, decoded once for the whole monitor layout, and its
+    original size. The image is kept in the in-memory cache, so that each
+    monitor can crop its part from it.
+    """
+    source_width, source_height = get_span_source_size(span)
+    image, image_size, texture = wallpaper_memory_cache.get(
+        get_span_source_key(wallpaper_path, span),
+        lambda: (*load_image(
+            wallpaper_path, source_width, source_height, STYLE_SPAN, False, cancellable
+        ), None)
+    )
+    return (image, image_size)
+
+def get_span_source_key(wallpaper_path, span):
+    """Returns the in-memory cache key of the image shared by spanned wallpapers."""
+    return wallpaper_memory_cache.get_key(
+        wallpaper_path, *get_span_source_size(span), STYLE_SPAN
+    )
+
+def evict_wallpaper(wallpaper_path, width, height, style, is_preview=False, span=None):
+    """
+    Removes a wallpaper loaded with load_wallpaper (with the same arguments)
+    from the in-memory cache, along with the image shared by spanned
+    wallpapers, so that their buffers can be freed.
+    """
+    wallpaper_memory_cache.remove(
+        wallpaper_memory_cache.get_key(wallpaper_path, width, height, style, is_preview, span)
+    )
+    if style == STYLE_SPAN and span:
+        wallpaper_memory_cache.remove(get_span_source_key(wallpaper_path, span))
+
+def update_cache_size(*args):
+    """Applies the wallpaper cache size settings to the wallpaper caches."""
+    wallpaper_cache.max_size = config['wallpaper-cache-size'] * 1024 * 1024
+    wallpaper_memory_cache.set_max_size(config['wallpaper-memory-cache-size'] * 1024 * 1024)
+
+update_cache_size()
+config.connect('changed::wallpaper-cache-size', update_cache_size)
+config.connect('changed::wallpaper-memory-cache-size', update_cache_size)
+
+def update_decoder(*args):
+    """Enables or disables out-of-process image decoding based on the settings."""
+    decoder_pool.enabled = config['out-of-process-decoding']
+    if not decoder_pool.enabled:
+        decoder_pool.shutdown()
+
+update_decoder()
+config.connect('changed::out-of-process-decoding', update_decoder)
+
+class MipmapPyramid:
+    """
+    Keeps a loaded image along with progressively halved copies of it
+    (levels), so that rescaling can start from the smallest copy that is
+    still larger than the target size, rather than from the full image.
+
+    Levels are only created once they are first needed, and are kept
+    until the pyramid is dropped; all of them together take up at most
+    a third of the memory of the original image.
+    """
+    # Levels are not halved below this size
+    MIN_SIZE = 128
+
+    def __init__(self, image):
+        """Initializes the pyramid."""
+        self.levels = [image]
+
+    def get_level(self, width, height):
+        """Returns the smallest level that is at least width x height large."""
+        index = 0
+        level = self.levels[0]
+        while True:
+            half_width = level.get_width() // 2
+            half_height = level.get_height() // 2
+            if half_width < max(width, self.MIN_SIZE) or \
+                    half_height < max(height, self.MIN_SIZE):
+                return level
+
+            index += 1
+            if index < len(self.levels):
+                level = self.levels[index]
+            else:
+                level = level.scale_simple(
+                    half_width, half_height, GdkPixbuf.InterpType.BILINEAR
+                )
+                self.levels.append(level)
+
+def scale_to_min(image, min_width, min_height):
+    """Returns the image, zoomed in to fill the given size and cropped."""
+    src_width = image.get_width()
+    src_height = image.get_height()
+    if src_width == min_width and src_height == min_height:
+        return image
+
+    factor = max(min_width / src_width, min_height / src_height)
+
+    new_width = math.floor(src_width * factor + 0.5)
+    new_height = math.floor(src_height * factor + 0.5)
+
+    dest = GdkPixbuf.Pixbuf.new(
+        GdkPixbuf.Colorspace.RGB,
+        image.get_has_alpha(),
+        8, min_width, min_height
+    )
+    if not dest:
+        return None
+
+    # crop the result
+    image.scale(dest,
+        0, 0,
+        min_width, min_height,
+        (new_width - min_width) / -2,
+        (new_height - min_height) / -2,
+        factor,
+        factor,
+        GdkPixbuf.InterpType.BILINEAR
+    )
+    return dest
+
+def scale_to_fit(image, width, height):
+    """
+    Returns the image, scaled to fit in the given size. The letterbox bars
+    are not part of the image; WallpaperPicture fills them with the
+    background color.
+    """
+    orig_width = image.get_width()
+    orig_height = image.get_height()
+    ratio = min(width / orig_width, height / orig_height)
+
+    final_width = max(1, math.ceil(ratio * orig_width))
+    final_height = max(1, math.ceil(ratio * orig_height))
+    if final_width == orig_width and final_height == orig_height:
+        return image
+
+    return image.scale_simple(final_width, final_height, GdkPixbuf.InterpType.BILINEAR)
+
+def render_span(image, span, width, height):
+    """
+    Returns a pixbuf with the part of the spanned image shown on the monitor
+    described by the span, scaled for a width x height wallpaper.
+    """
+    crop = get_span_crop(image.get_width(), image.get_height(), span)
+    # Sub-pixbufs share the pixels of the full image
+    return scale_to_min(image.new_subpixbuf(*crop), width, height)
+
+def render_wallpaper(image, style, width, height, span=None):
+    """
+    Returns a pixbuf with the image scaled for a width x height wallpaper
+    in the given style (0 - solid color, 1 - fit, 2 - zoom, 3 - span), or
+    None if only the background color is shown. Spanned wallpapers without
+    a span (like the settings preview) are zoomed. Doesn't touch any
+    widgets, so it can be called from other threads.
+    """
+    if not image or width <= 0 or height <= 0:
+        return None
+    if style == 1:
+        return scale_to_fit(image, width, height)
+    elif style == STYLE_SPAN and span:
+        return render_span(image, span, width, height)
+    elif style != 0:
+        return scale_to_min(image, width, height)
+    return None
+
+def texture_for_pixbuf(pixbuf):
+    """
+    Returns a texture containing the given pixbuf, or None if there is no
+    pixbuf. Textures are immutable, so this can be called from other threads.
+    """
+    if not pixbuf:
+        return None
+    return Gdk.Texture.new_for_pixbuf(pixbuf)
 
 class SlideshowManager:
-    """Convenience class for managing slideshows."""
+    """
+    Convenience class for managing slideshows.
+
+    The time of the next switch is stored in the config as a timestamp, so
+    that the slideshow can resume after a restart; it is only written once
+    per switch (or when the countdown is restarted).
+
+    The order of wallpapers is kept in a SlideshowPlaylist, which is
+    updated incrementally when the list of available wallpapers changes;
+    the position in the playlist is stored in the config along with the
+    cycle.
+    Wallpapers can have their own display times (slideshow-durations);
+    other wallpapers use the switch delay.
+
+    Shortly before a switch (see slideshow-prefetch-window), the next
+    wallpaper is prefetched by all registered Wallpaper objects, so that
+    the switch itself doesn't have to wait for the image to load.
+    """
     def __init__(self):
         """Initializes the SlideshowManager."""
-        self.counter = config['slideshow-switch-counter']
-        config.connect('changed::wallpaper-path', self.update_counter)
-        config.connect('changed::slideshow-switch-delay', self.update_counter)
-        clock_daemon.connect('notify::time', self.switch_tick)
+        self.switch_timer = None
+        self.prefetch_timer = None
+        self.wallpapers = []
+        self._switching = False
+
+        self.playlist = SlideshowPlaylist(
+            config['available-wallpapers'],
+            order=config['slideshow-order'],
+            weights=config['slideshow-weights'],
+            cycle=config['slideshow-cycle']
+        )
+        self.playlist.seek(config['wallpaper-path'], config['slideshow-position'])
+        self.durations = config['slideshow-durations']
+
+        config.connect('changed::available-wallpapers', self.update_wallpapers)
+        config.connect('changed::slideshow-order', self.update_order)
+        config.connect('changed::slideshow-weights', self.update_order)
+        config.connect('changed::slideshow-durations', self.update_durations)
+
+        config.connect('changed::wallpaper-path', self.on_wallpaper_change)
+        config.connect('changed::slideshow-switch-delay', self.restart_countdown)
+        config.connect('changed::slideshow-mode', self.restart_countdown)
+        config.connect('changed::slideshow-prefetch-window', self.schedule_prefetch)
+        clock_daemon.connect('time-jumped', self.schedule_switch)
+        self.schedule_switch()
+
+    def update_wallpapers(self, *args):
+        """Updates the playlist after the available wallpapers change."""
+        self.playlist.update_wallpapers(config['available-wallpapers'])
+        self.save_position()
+        self.discard_prefetched()
+        self.schedule_prefetch()
+
+    def update_order(self, *args):
+        """Regenerates the playlist after the order settings change."""
+        self.playlist.set_order(config['slideshow-order'], config['slideshow-weights'])
+        self.save_position()
+        self.discard_prefetched()
+        self.schedule_prefetch()
+
+    def update_durations(self, *args):
+        """Reloads the per-wallpaper display times."""
+        self.durations = config['slideshow-durations']
+        self.schedule_switch()
+
+    def save_position(self):
+        """Stores the position in the playlist in the config, if it changed."""
+        if config['slideshow-position'] != self.playlist.position:
+            config['slideshow-position'] = self.playlist.position
+
+    def get_duration(self, wallpaper):
+        """Returns the amount of time (in seconds) to display the wallpaper for."""
+        return self.durations.get(wallpaper, config['slideshow-switch-delay'])
 
-    def update_counter(self, *args):
-        """Updates the counter to match the delay."""
-        self.counter = config['slideshow-switch-delay']
+    def restart_countdown(self, *args):
+        """Sets the next switch to happen after the full display time."""
+        config['slideshow-next-switch'] = \
+            int(time.time()) + self.get_duration(config['wallpaper-path'])
+        self.schedule_switch()
+
+    def schedule_switch(self, *args):
+        """
+        Schedules the next switch based on the time stored in the config,
+        or cancels it if slideshow mode is disabled.
+        """
+        if self.switch_timer:
+            clock_daemon.unsubscribe(self.switch_timer)
+            self.switch_timer = None
 
-    def switch_tick(self, *args):
         if not config['slideshow-mode']:
+            self.schedule_prefetch()
             return
 
-        if self.counter <= 0:
-            self.counter = config['slideshow-switch-delay']
-            available_wallpapers = config['available-wallpapers']
-            current_wallpaper = config['wallpaper-path']
+        next_switch = config['slideshow-next-switch']
+        duration = self.get_duration(config['wallpaper-path'])
+        # Unset, or too far away (the delay was shortened or the clock was set back)
+        if next_switch <= 0 or next_switch > time.time() + duration:
+            self.restart_countdown()
+            return
 
-            if current_wallpaper not in available_wallpapers:
-                config['wallpaper-path'] = available_wallpapers[0]
-            else:
-                next_wallpaper_index = available_wallpapers.index(current_wallpaper) + 1
-                if next_wallpaper_index >= len(available_wallpapers):
-                    next_wallpaper_index = 0
-                config['wallpaper-path'] = available_wallpapers[next_wallpaper_index]
+        self.switch_timer = clock_daemon.schedule_at(next_switch, self.switch, owner=self)
+        self.schedule_prefetch()
+
+    def add_wallpaper(self, wallpaper):
+        """Registers a Wallpaper object that should prefetch upcoming wallpapers."""
+        if wallpaper not in self.wallpapers:
+            self.wallpapers.append(wallpaper)
+            self.schedule_prefetch()
+
+    def remove_wallpaper(self, wallpaper):
+        """Unregisters a Wallpaper object."""
+        if wallpaper in self.wallpapers:
+            self.wallpapers.remove(wallpaper)
+
+    def schedule_prefetch(self, *args):
+        """
+        Schedules the prefetch of the next wallpaper, or cancels it if
+        there is no upcoming switch or prefetching is disabled.
+        """
+        if self.prefetch_timer:
+            clock_daemon.unsubscribe(self.prefetch_timer)
+            self.prefetch_timer = None
+
+        window = config['slideshow-prefetch-window']
+        if not self.switch_timer or not self.wallpapers or window <= 0:
+            return
+
+        self.prefetch_timer = clock_daemon.schedule_at(
+            config['slideshow-next-switch'] - window, self.prefetch, owner=self
+        )
+
+    def prefetch(self, *args):
+        """Starts prefetching the next wallpaper."""
+        self.prefetch_timer = None
+        next_wallpaper = self.playlist.peek()
+        if not next_wallpaper or next_wallpaper == config['wallpaper-path']:
+            return
+        for wallpaper in self.wallpapers:
+            wallpaper.prefetch(next_wallpaper)
+
+    def discard_prefetched(self):
+        """Drops the prefetched wallpaper from all registered Wallpaper objects."""
+        for wallpaper in self.wallpapers:
+            wallpaper.discard_prefetched()
+
+    def on_wallpaper_change(self, *args):
+        """Continues the playlist from manually selected wallpapers."""
+        if not self._switching:
+            self.playlist.seek(config['wallpaper-path'])
+            self.save_position()
+            self.restart_countdown()
+
+    def switch(self, *args):
+        """Switches to the next wallpaper."""
+        self.switch_timer = None
+        cycle = self.playlist.cycle
+        next_wallpaper = self.playlist.advance()
+        if not next_wallpaper:
+            self.restart_countdown()
+            return
+
+        self._switching = True
+        config['slideshow-next-switch'] = int(time.time()) + self.get_duration(next_wallpaper)
+        if self.playlist.cycle != cycle:
+            config['slideshow-cycle'] = self.playlist.cycle
+        self.save_position()
+        config['wallpaper-path'] = next_wallpaper
+        self._switching = False
 
-        self.counter -= 1
-        config['slideshow-switch-counter'] = self.counter
+        self.schedule_switch()
 
 slideshow_manager = SlideshowManager()
 
+class WallpaperPicture(Gtk.Widget):
+    """
+    Displays a pre-rendered wallpaper texture.
+
+    Unlike a drawing area, the texture is uploaded once and added to the
+    snapshot as a single texture node, which lets GSK keep it on the GPU
+    between redraws. The texture is centered on top of a fill in the
+    background color, so the solid color style and letterbox bars don't
+    need any pixel buffers.
+
+    Crossfades are drawn in the same snapshot, using a cross-fade node
+    between the previous and the current wallpaper; the previous texture
+    is released as soon as the crossfade ends.
+
+    Textures are expected to be rendered at device pixel resolution; the
+    size in device pixels (based on the scale of the surface, including
+    fractional scales) is available through get_device_size() and is
+    passed to the resize signal.
+    """
+    __gtype_name__ = 'WallpaperPicture'
+
+    def __init__(self):
+        """Initializes a WallpaperPicture."""
+        super().__init__()
+        self.scale = 1
+        self.surface = None
+        self._surface_handler = None
+        self.texture = None
+        self.color = None
+        self.texture_scale = 1
+        self.fade_texture = None
+        self.fade_texture_scale = 1
+        self.fade_color = None
+        self.fade_progress = 1
+        self.fade_animation = None
+        self._device_size = (0, 0)
+
+        self.connect('notify::scale-factor', self.update_scale)
+        self.connect('realize', self._on_realize)
+        self.connect('unrealize', self._on_unrealize)
+
+    @GObject.Signal(arg_types=(int, int))
+    def resize(self, width, height):
+        """Emitted when the size of the picture in device pixels changes."""
+        pass
+
+    def _on_realize(self, *args):
+        """Starts following the scale of the surface."""
+        self.surface = self.get_native().get_surface()
+        # Fractional scales are only available since GTK 4.12
+        if hasattr(self.surface.props, 'scale'):
+            self._surface_handler = self.surface.connect('notify::scale', self.update_scale)
+        self.update_scale()
+
+    def _on_unrealize(self, *args):
+        """Stops following the scale of the surface."""
+        if self._surface_handler:
+            self.surface.disconnect(self._surface_handler)
+            self._surface_handler = None
+        self.surface = None
+
+    def get_device_scale(self):
+        """Returns the scale of the surface the picture is displayed on."""
+        if self.surface and self._surface_handler:
+            return self.surface.get_scale()
+        return self.get_scale_factor()
+
+    def update_scale(self, *args):
+        """Updates the scale after the surface scale changed."""
+        self.scale = self.get_device_scale()
+        self.update_device_size()
+        self.queue_draw()
+
+    def get_device_size(self):
+        """Returns the size of the picture in device pixels."""
+        return self._device_size
+
+    def update_device_size(self):
+        """Emits the resize signal if the size in device pixels changed."""
+        device_size = (
+            math.ceil(self.get_width() * self.scale),
+            math.ceil(self.get_height() * self.scale)
+        )
+        if device_size != self._device_size:
+            self._device_size = device_size
+            self.emit('resize', *device_size)
+
+    def get_texture(self):
+        """Returns the displayed texture."""
+        return self.texture
+
+    def set_texture(self, texture, texture_scale=1):
+        """
+        Sets the texture to display. Textures with a lower resolution (like
+        placeholders) can be enlarged by the given texture scale.
+        """
+        if texture is not self.texture or texture_scale != self.texture_scale:
+            self.texture = texture
+            self.texture_scale = texture_scale
+            self.queue_draw()
+
+    def set_color(self, color):
+        """Sets the background color (a Gdk.RGBA)."""
+        if not self.color or not color or not self.color.equal(color):
+            self.color = color
+            self.queue_draw()
+
+    def crossfade(self, duration):
+        """
+        Starts a crossfade (lasting the given amount of miliseconds) from
+        the currently displayed wallpaper; changes made right after calling
+        this fade in.
+        """
+        if self.fade_animation:
+            self.fade_animation.skip()
+
+        if duration <= 0 or not self.get_mapped():
+            return
+
+        self.fade_texture = self.texture
+        self.fade_texture_scale = self.texture_scale
+        self.fade_color = self.color
+        self.fade_progress = 0
+
+        self.fade_animation = Adw.TimedAnimation.new(
+            self, 0, 1, duration,
+            Adw.CallbackAnimationTarget.new(self._on_fade_progress)
+        )
+        self.fade_animation.connect('done', self._on_fade_done)
+        self.fade_animation.play()
+
+    def _on_fade_progress(self, value):
+        """Redraws the picture with the new crossfade progress."""
+        self.fade_progress = value
+        self.queue_draw()
+
+    def _on_fade_done(self, *args):
+        """Releases the previous wallpaper once the crossfade is over."""
+        self.fade_animation = None
+        self.fade_texture = None
+        self.fade_color = None
+        self.fade_progress = 1
+        self.queue_draw()
+
+    def do_size_allocate(self, width, height, baseline):
+        """Emits the resize signal when the size changes."""
+        self.update_device_size()
+
+    def do_snapshot(self, snapshot):
+        """Draws the wallpaper, crossfading from the previous one if needed."""
+        if self.fade_progress < 1:
+            snapshot.push_cross_fade(self.fade_progress)
+            self.snapshot_wallpaper(
+                snapshot, self.fade_texture, self.fade_texture_scale, self.fade_color
+            )
+            snapshot.pop()
+            self.snapshot_wallpaper(snapshot, self.texture, self.texture_scale, self.color)
+            snapshot.pop()
+        else:
+            self.snapshot_wallpaper(snapshot, self.texture, self.texture_scale, self.color)
+
+    def snapshot_wallpaper(self, snapshot, texture, texture_scale, color):
+        """Draws the background color and the texture."""
+        width = self.get_width()
+        height = self.get_height()
+        if color:
+            snapshot.append_color(color, Graphene.Rect().init(0, 0, width, height))
+
+        if texture:
+            texture_width = texture.get_width() * texture_scale / self.scale
+            texture_height = texture.get_height() * texture_scale / self.scale
+            bounds = Graphene.Rect().init(
+                (width - texture_width) / 2, (height - texture_height) / 2,
+                texture_width, texture_height
+            )
+            snapshot.append_texture(texture, bounds)
+
 @Gtk.Template(resource_path='/org/dithernet/aspinwall/launcher/ui/wallpaper.ui')
-class Wallpaper(Gtk.Stack, Dimmable):
-    """Wallpaper image that reads wallpaper data from the config."""
+class Wallpaper(Adw.Bin, Dimmable):
+    """
+    Wallpaper image that reads wallpaper data from the config.
+
+    Images are loaded in a separate thread; the previous wallpaper stays
+    on screen until the new one is ready, and starting a new load cancels
+    the one in progress.
+
+    Wallpapers are rendered in device pixels. All loads and renders go
+    through the shared in-memory wallpaper cache, so that moving the
+    launcher back to a monitor with a different scale, or showing the same
+    wallpaper in the settings preview, doesn't render it again.
+
+    While the wallpaper is hidden (unmapped, or on a minimized or suspended
+    surface), the loaded wallpaper is released and replaced by a small
+    placeholder; it is loaded again once the wallpaper is shown (see
+    release() and restore()).
+    """
     __gtype_name__ = 'Wallpaper'
 
+    # The placeholder is rendered at 1/PLACEHOLDER_SCALE of the wallpaper size
+    PLACEHOLDER_SCALE = 8
+
     wallpaper = Gtk.Template.Child()
-    wallpaper_fade = Gtk.Template.Child()
 
     _is_preview = False
-
-    # TODO: properly source this
-    scale = 1
+    _loading = False
 
     def __init__(self):
         """Initializes a Wallpaper object."""
         super().__init__()
-        self.pixbuf = GdkPixbuf.Pixbuf()
-        self.fade_pixbuf = GdkPixbuf.Pixbuf()
+        self.image = None
+        self.image_size = None
+        self.image_levels = None
+        self.image_key = None
+        self.prefetched = None
+        self._prefetch_key = None
+        self.cancellable = None
+        self._load_generation = 0
+        self._showing_preview = False
+        self._needs_load = True
+        self.released = False
+        self.surface = None
+        self._surface_handler = None
+        self._surface_hidden = False
+        self._monitor_handlers = []
+        self._span = None
 
         self.update_background_color()
-        self.set_image_from_config()
 
-        self.wallpaper.set_draw_func(self.draw)
-        self.wallpaper.connect('resize', self.update)
+        self.wallpaper.connect('resize', self.discard_prefetched)
+        self.wallpaper.connect('resize', self.on_resize)
 
-        self.wallpaper_fade.set_draw_func(self.draw, 'fade_pixbuf')
+        self._changed_keys = set()
+        self._apply_source = None
+        config.connect('changed::wallpaper-path', self.queue_changes)
+        config.connect('changed::wallpaper-style', self.queue_changes)
+        config.connect('changed::wallpaper-color', self.queue_changes)
 
-        config.connect('changed::wallpaper-path', self.load_image_and_update)
-        config.connect('changed::wallpaper-style', self.load_image_and_update)
-        config.connect('changed::wallpaper-color', self.load_image_and_update)
-
-        self.connect('notify::transition-running', self.cleanup_fade)
+        self.connect('realize', self._on_realize)
         self.connect('unrealize', self._destroy)
+        self.connect('map', self.restore)
+        self.connect('unmap', self.release)
 
     @GObject.Property(type=bool, default=False)
     def is_preview(self):
@@ -102,155 +853,452 @@ class Wallpaper(Gtk.Stack, Dimmable):
     def is_preview(self, value):
         self._is_preview = value
 
+    @GObject.Property(type=bool, default=False, flags=GObject.ParamFlags.READABLE)
+    def loading(self):
+        """Whether a wallpaper is currently being loaded."""
+        return self._loading
+
+    def set_loading(self, value):
+        """Sets the loading property."""
+        if self._loading != value:
+            self._loading = value
+            self.notify('loading')
+
+    def _on_realize(self, *args):
+        """Registers the wallpaper with the slideshow manager."""
+        surface = self.get_native().get_surface()
+        if isinstance(surface, Gdk.Toplevel):
+            self.surface = surface
+            self._surface_handler = surface.connect(
+                'notify::state', self.on_surface_state_change
+            )
+
+        monitors = self.get_display().get_monitors()
+        self._monitor_handlers = [
+            (monitors, monitors.connect('items-changed', self.on_monitors_change)),
+            (surface, surface.connect('enter-monitor', self.on_monitors_change))
+        ]
+
+        # The first load is deferred until the wallpaper has a size (see
+        # on_resize), so that it can be rendered in the load thread
+        if self._needs_load and self.get_render_size()[0] > 0:
+            self.load()
+        slideshow_manager.add_wallpaper(self)
+
     def _destroy(self, *args):
         """Removes the wallpaper."""
-        self.pixbuf = None
-        self.fade_pixbuf = None
+        if self._surface_handler:
+            self.surface.disconnect(self._surface_handler)
+            self._surface_handler = None
+        for obj, handler in self._monitor_handlers:
+            obj.disconnect(handler)
+        self._monitor_handlers = []
+        self.surface = None
+        self._surface_hidden = False
+        self.released = False
+        slideshow_manager.remove_wallpaper(self)
+        self.cancel_load()
+        self.discard_prefetched()
+        self._needs_load = True
+        self.wallpaper.set_texture(None)
         self.image = None
+        self.image_size = None
+        self.image_levels = None
+        self.image_key = None
 
-    def draw(self, area, cr, *args):
-        """Draws the background."""
-        if args[-1] == 'fade_pixbuf':
-            source_pixbuf = self.fade_pixbuf
-        else:
-            source_pixbuf = self.pixbuf
-        x = 0
-        y = 0
-        cr.save()
-        cr.scale(1.0 / self.scale, 1.0 / self.scale)
-        Gdk.cairo_set_source_pixbuf(cr, source_pixbuf, x * self.scale, y * self.scale)
-        cr.paint()
-        cr.restore()
-        return True
-
-    def set_image_from_config(self):
-        """
-        Sets the image to a pixbuf created from the image file provided
-        in the config file.
-        """
-        wallpaper_path = config['wallpaper-path']
-        if wallpaper_path and not wallpaper_path == '/' and os.path.exists(wallpaper_path):
-            try:
-                if not self._is_preview:
-                    self.image = GdkPixbuf.Pixbuf.new_from_file(wallpaper_path)
-                else:
-                    self.image = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                        wallpaper_path,
-                        240, 135, # The settings preview has a set size of 240x135
-                        True
-                    )
-            except GLib.GError:
-                traceback.print_exc()
-                self.image = None
+    def load(self):
+        """
+        Starts loading the wallpaper from the config in a separate thread,
+        cancelling any load that is already in progress.
+        """
+        self.cancel_load()
+        self._needs_load = False
+        self.cancellable = Gio.Cancellable()
+        self._showing_preview = False
+        key = self.get_render_key(config['wallpaper-path'])
+        self._span = key[5]
+
+        self.set_loading(True)
+        load_thread = threading.Thread(
+            target=self._load, args=[key, self._load_generation, self.cancellable],
+            daemon=True
+        )
+        load_thread.start()
+
+    def _load(self, key, generation, cancellable):
+        """Loads and renders a wallpaper; runs in the load thread."""
+        wallpaper_path, width, height, style, is_preview, span = key
+
+        def on_preview(image):
+            """Passes a low resolution version of the wallpaper on to show_preview."""
+            GLib.idle_add(
+                self.show_preview, generation, texture_for_pixbuf(image), style, (width, height)
+            )
+
+        image, image_size, texture = load_wallpaper(*key, cancellable, on_preview)
+        if cancellable.is_cancelled():
+            return
+        GLib.idle_add(
+            self._finish_load, generation, key, image, image_size, texture, (width, height)
+        )
+
+    def _finish_load(self, generation, key, image, image_size, texture, size):
+        """Shows the loaded wallpaper, unless a newer load was started."""
+        if generation == self._load_generation:
+            self.cancellable = None
+            self.set_loading(False)
+            if size != self.get_render_size():
+                # The wallpaper was resized while loading
+                texture = None
+            self.show_image(key, image, image_size, texture)
+        return False
+
+    def show_preview(self, generation, texture, style, size):
+        """
+        Shows a low resolution version of the wallpaper being loaded,
+        enlarged to the size the final wallpaper will be shown at.
+        """
+        if generation != self._load_generation or size != self.get_render_size():
+            return False
+
+        if not self._showing_preview:
+            self._showing_preview = True
+            self.crossfade()
+            self.update_background_color()
+        render_width, render_height = get_decode_size(
+            texture.get_width(), texture.get_height(), *size, style, upscale=True
+        )
+        self.wallpaper.set_texture(texture, render_width / texture.get_width())
+        return False
+
+    def cancel_load(self):
+        """Cancels the wallpaper load in progress, if any."""
+        self._load_generation += 1
+        if self.cancellable:
+            self.cancellable.cancel()
+            self.cancellable = None
+        self.set_loading(False)
+
+    def on_surface_state_change(self, *args):
+        """Releases the wallpaper while the surface is minimized or suspended."""
+        hidden_states = Gdk.ToplevelState.MINIMIZED
+        # The suspended state is only available since GTK 4.12
+        if hasattr(Gdk.ToplevelState, 'SUSPENDED'):
+            hidden_states |= Gdk.ToplevelState.SUSPENDED
+
+        surface_hidden = bool(self.surface.get_state() & hidden_states)
+        if surface_hidden == self._surface_hidden:
+            return
+        self._surface_hidden = surface_hidden
+        if surface_hidden:
+            self.release()
         else:
-            self.image = None
+            self.restore()
 
-    def update(self, *args):
-        """Updates the background."""
-        width = self.get_width()
-        height = self.get_height()
+    def release(self, *args):
+        """
+        Drops this wallpaper's loaded image and texture to save memory,
+        keeping only a small placeholder on screen until restore() is called.
+        Its own entries are removed from the in-memory cache as well; other
+        variants of the wallpaper (like the settings preview) are left to the
+        cache size limit. Previews are only unmapped when they're closed, so
+        they're not released.
+        """
+        if self.released or self._is_preview or not self.get_realized():
+            return
+        self.released = True
+
+        placeholder = self.create_placeholder()
+        self.cancel_load()
+        self.discard_prefetched()
+        if self.image_key:
+            wallpaper_path, width, height, style, is_preview, span = self.image_key
+            evict_wallpaper(*self.image_key)
+            # The image may have been re-rendered at another size since (see update)
+            if (width, height) != self.get_render_size():
+                evict_wallpaper(
+                    wallpaper_path, *self.get_render_size(), style, is_preview, span
+                )
+        self._needs_load = True
+        self.image = None
+        self.image_size = None
+        self.image_levels = None
+        self.image_key = None
+        self.wallpaper.set_texture(placeholder, self.PLACEHOLDER_SCALE)
+
+    def restore(self, *args):
+        """Loads the wallpaper again after it was released."""
+        if not self.released:
+            return
+        self.released = False
+        if self.get_realized():
+            self.load()
 
-        self.fade_pixbuf = self.pixbuf
+    def create_placeholder(self):
+        """Returns a low-resolution texture of the current wallpaper, or None."""
+        width, height = self.get_render_size()
+        width = width // self.PLACEHOLDER_SCALE
+        height = height // self.PLACEHOLDER_SCALE
+        if width <= 0 or height <= 0:
+            return None
 
         if self.image:
-            if config['wallpaper-style'] == 0:
-                self.pixbuf = self.blank_bg(width, height)
-            elif config['wallpaper-style'] == 1:
-                self.pixbuf = self.scale_to_fit(width, height)
-            else:
-                self.pixbuf = self.scale_to_min(width, height)
+            return texture_for_pixbuf(self.render_image(width, height))
+
+        # Wallpapers loaded from the on-disk cache only have a texture
+        texture = self.wallpaper.get_texture()
+        if not texture or self.wallpaper.texture_scale != 1:
+            return None
+        return texture_for_pixbuf(Gdk.pixbuf_get_from_texture(texture).scale_simple(
+            max(1, texture.get_width() // self.PLACEHOLDER_SCALE),
+            max(1, texture.get_height() // self.PLACEHOLDER_SCALE),
+            GdkPixbuf.InterpType.BILINEAR
+        ))
+
+    def on_resize(self, *args):
+        """Renders the wallpaper at the new size, loading it first if needed."""
+        if self.released:
+            # The wallpaper is rendered at the right size once it's restored
+            return
+        if self._needs_load or self.needs_reload():
+            self.load()
+        elif not self._loading:
+            # Loads in progress re-render the wallpaper once they finish
+            self.update()
+
+    def get_render_size(self):
+        """Returns the size of the wallpaper in device pixels."""
+        return self.wallpaper.get_device_size()
+
+    def needs_reload(self):
+        """
+        Returns True if the wallpaper has to be loaded again to be rendered
+        at the current size; that is, if the loaded image was decoded at a
+        lower resolution than needed, or if only a cached rendering of the
+        wallpaper was loaded.
+        """
+        if not self.image_size:
+            return False
+        if not self.image:
+            return True
+        span = self.get_span()
+        if span != self._span:
+            return True
+        if span:
+            target_size = get_span_source_size(span)
         else:
-            self.pixbuf = self.blank_bg(width, height)
+            target_size = self.get_render_size()
+        decode_width, decode_height = get_decode_size(
+            *self.image_size, *target_size, config['wallpaper-style']
+        )
+        return decode_width > self.image.get_width() or \
+            decode_height > self.image.get_height()
+
+    def update(self, *args):
+        """
+        Renders the loaded image at the current size. The image is cached
+        under the key it was loaded with (see show_image), rather than the
+        current settings, which may already point to a wallpaper that's
+        still loading.
+        """
+        width, height = self.get_render_size()
+        if width <= 0 or height <= 0 or not self.image_key:
+            return
+        wallpaper_path, _, _, style, is_preview, span = self.image_key
+        cache_key = wallpaper_memory_cache.get_key(
+            wallpaper_path, width, height, style, is_preview, span
+        )
+        cached = wallpaper_memory_cache.lookup(cache_key)
+        if cached:
+            self.wallpaper.set_texture(cached[2])
+            return
+
+        texture = texture_for_pixbuf(self.render_image(width, height))
+        self.wallpaper.set_texture(texture)
+        if texture:
+            wallpaper_memory_cache.store(cache_key, (self.image, self.image_size, texture))
+
+    def render_image(self, width, height):
+        """
+        Renders the loaded image for a width x height area, in the style it
+        was loaded with, starting from the smallest pyramid level that
+        covers it.
+        """
+        style = self.image_key[3]
+        span = self.image_key[5]
+        image = self.image
+        if span:
+            # Monitors crop their part from the full-size spanned image
+            return render_wallpaper(image, style, width, height, span)
+        if self.image_levels:
+            image = self.image_levels.get_level(*get_decode_size(
+                image.get_width(), image.get_height(), width, height, style
+            ))
+        return render_wallpaper(image, style, width, height)
 
     def update_background_color(self, *args):
         """Sets the background color based on the wallpaper-color setting."""
-        self.background_color = color_to_pixel(config['wallpaper-color'])
+        self.wallpaper.set_color(color_to_rgba(config['wallpaper-color']))
 
-    def load_image_and_update(self, *args):
+    def queue_changes(self, settings, key):
         """
-        Convenience function to call when the wallpaper is changed.
-        Automatically takes care of the wallpaper transition.
+        Collects changes to the wallpaper settings, so that changing several
+        of them at once (like the settings window does) only reloads the
+        wallpaper once, after the current main loop iteration.
         """
-        self.wallpaper_fade.queue_draw()
+        self._changed_keys.add(key)
+        if not self._apply_source:
+            self._apply_source = GLib.idle_add(self.apply_changes)
 
-        # Do the crossfade
-        self.set_transition_duration(0)
-        self.set_visible_child(self.wallpaper_fade)
-        self.set_transition_duration(config['slideshow-switch-length'])
-        self.set_visible_child(self.wallpaper)
+    def apply_changes(self):
+        """Applies the collected changes to the wallpaper settings."""
+        self._apply_source = None
+        changed_keys = self._changed_keys
+        self._changed_keys = set()
 
+        if 'wallpaper-path' in changed_keys or 'wallpaper-style' in changed_keys:
+            if 'wallpaper-style' in changed_keys:
+                self.discard_prefetched()
+            # The background color is updated along with the new image
+            self.load_image_and_update()
+        elif 'wallpaper-color' in changed_keys:
+            self.on_color_change()
+        return False
+
+    def on_color_change(self, *args):
+        """Crossfades to the new background color."""
+        if self.get_realized():
+            self.crossfade()
         self.update_background_color()
-        self.set_image_from_config()
-        self.update()
-        self.wallpaper.queue_draw()
-
-    def cleanup_fade(self, *args):
-        """Clears the wallpaper fade buffer."""
-        self.fade_pixbuf = None
-
-    def blank_bg(self, width, height):
-        """Returns an empty pixbuf, filled with the background color."""
-        bg = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, width, height)
-        bg.fill(self.background_color)
-        return bg
-
-    def scale_to_min(self, min_width, min_height):
-        """Returns the background, zoomed in to fit."""
-        src_width = self.image.get_width()
-        src_height = self.image.get_height()
-
-        factor = max(min_width / src_width, min_height / src_height)
-
-        new_width = math.floor(src_width * factor + 0.5)
-        new_height = math.floor(src_height * factor + 0.5)
-
-        dest = GdkPixbuf.Pixbuf.new(
-            GdkPixbuf.Colorspace.RGB,
-            self.image.get_has_alpha,
-            8, min_width, min_height
+
+    def get_render_key(self, wallpaper_path):
+        """
+        Returns a tuple describing how the given wallpaper would be rendered
+        with the current settings; used to check if a prefetched wallpaper
+        can be used. The tuple matches the arguments of load_wallpaper().
+        """
+        return (
+            wallpaper_path, *self.get_render_size(),
+            config['wallpaper-style'], self._is_preview, self.get_span()
         )
-        if not dest:
+
+    def get_span(self):
+        """
+        Returns a tuple describing the part of the monitor layout covered by
+        the wallpaper when it's spanned across all monitors (see
+        get_monitor_span), or None if the wallpaper isn't spanned.
+        """
+        if config['wallpaper-style'] != STYLE_SPAN or self._is_preview or not self.surface:
             return None
 
-        # crop the result
-        self.image.scale(dest,
-            0, 0,
-            min_width, min_height,
-            (new_width - min_width) / -2,
-            (new_height - min_height) / -2,
-            factor,
-            factor,
-            GdkPixbuf.InterpType.BILINEAR
+        display = self.get_display()
+        monitor = display.get_monitor_at_surface(self.surface)
+        monitor_list = display.get_monitors()
+        monitors = [monitor_list.get_item(i) for i in range(monitor_list.get_n_items())]
+        if not monitor or not monitors:
+            return None
+
+        def get_rectangle(monitor):
+            """Returns the geometry of the monitor as a tuple."""
+            geometry = monitor.get_geometry()
+            return (geometry.x, geometry.y, geometry.width, geometry.height)
+
+        def get_scale(monitor):
+            """Returns the scale of the monitor, fractional since GTK 4.14."""
+            if hasattr(monitor, 'get_scale'):
+                return monitor.get_scale()
+            return monitor.get_scale_factor()
+
+        return get_monitor_span(
+            [get_rectangle(m) for m in monitors], get_rectangle(monitor),
+            [get_scale(m) for m in monitors]
         )
-        return dest
 
-    def scale_to_fit(self, width, height):
-        """Returns the background, scaled to fit."""
-        bg = self.blank_bg(width, height)
+    def on_monitors_change(self, *args):
+        """Reloads spanned wallpapers when the monitor layout changes."""
+        if self.released or self._needs_load:
+            return
+        if self.get_span() != self._span:
+            self.load()
+
+    def prefetch(self, wallpaper_path):
+        """
+        Loads and scales the given wallpaper in a separate thread, so that
+        switching to it later doesn't block the main thread.
+        """
+        width, height = self.get_render_size()
+        if width <= 0 or height <= 0 or self.released:
+            return
+
+        key = self.get_render_key(wallpaper_path)
+        if self._prefetch_key == key or (self.prefetched and self.prefetched[0] == key):
+            return
+
+        self.prefetched = None
+        self._prefetch_key = key
+        prefetch_thread = threading.Thread(target=self._prefetch, args=[key], daemon=True)
+        prefetch_thread.start()
+
+    def _prefetch(self, key):
+        """Loads and renders a wallpaper; runs in the prefetch thread."""
+        image, image_size, texture = load_wallpaper(*key)
+        GLib.idle_add(self._finish_prefetch, key, image, image_size, texture)
+
+    def _finish_prefetch(self, key, image, image_size, texture):
+        """Stores the prefetched wallpaper, unless it was discarded in the meantime."""
+        if self._prefetch_key == key:
+            self.prefetched = (key, image, image_size, texture)
+            self._prefetch_key = None
+        return False
+
+    def discard_prefetched(self, *args):
+        """Drops the prefetched wallpaper and ignores any running prefetch."""
+        self.prefetched = None
+        self._prefetch_key = None
+
+    def load_image_and_update(self, *args):
+        """
+        Convenience function to call when the wallpaper is changed.
+        Automatically takes care of the wallpaper transition.
+        """
+        if not self.get_realized() or self.released:
+            # Hidden wallpapers (like a closed settings window) load once
+            # they're realized or restored
+            self._needs_load = True
+            return
+
+        prefetched = self.prefetched
+        if prefetched and prefetched[0] == self.get_render_key(config['wallpaper-path']):
+            self.cancel_load()
+            self.prefetched = None
+            self.show_image(*prefetched)
+        else:
+            self.load()
 
-        orig_width = self.image.get_width()
-        orig_height = self.image.get_height()
-        ratio_horiz = width / orig_width
-        ratio_vert = height / orig_height
+    def show_image(self, key, image, image_size, texture):
+        """
+        Crossfades to the given image (with the given original size) and its
+        rendered texture; key is the render key the image was loaded with
+        (see get_render_key).
+        """
+        self.crossfade()
+        self.update_background_color()
 
-        if ratio_horiz > ratio_vert:
-            ratio = ratio_vert
+        self.image = image
+        self.image_size = image_size
+        self.image_key = key
+        self.image_levels = MipmapPyramid(image) if image else None
+        if texture or not image_size:
+            self.wallpaper.set_texture(texture)
+        elif image:
+            self.update()
         else:
-            ratio = ratio_horiz
-        final_width = math.ceil(ratio * orig_width)
-        final_height = math.ceil(ratio * orig_height)
-
-        off_x = (width - final_width) / 2
-        off_y = (height - final_height) / 2
-        self.image.composite(
-            bg,
-            off_x, off_y,
-            final_width,
-            final_height,
-            off_x, off_y,
-            ratio,
-            ratio,
-            GdkPixbuf.InterpType.BILINEAR,
-            255)
-
-        return bg
+            # A cached wallpaper for a different size was loaded
+            self.load()
+
+    def crossfade(self):
+        """
+        Starts a crossfade from the currently displayed wallpaper; changes
+        made right after calling this fade in.
+        """
+        self.wallpaper.crossfade(config['slideshow-switch-length'])
@@ -34,14 +34,13 @@ class LoadedWidgetManager(GObject.Object):
                 self.emit('widget-failed', error[1], error[2])
 
         # Set up autorefresh
+        self.autorefresh_timer = None
         self.set_autorefresh_frequency()
         config.connect(
-            'changed::widget-automatic-refresh-frequency',
+            'changed::widget-autorefresh-frequency',
             self.set_autorefresh_frequency
         )
 
-        clock_daemon.connect('notify::time', self.autorefresh_tick)
-
     # Loading/saving
     def load_widgets(self):
         """Loads widgets from the launcher config."""
@@ -157,19 +156,29 @@ class LoadedWidgetManager(GObject.Object):
     def set_autorefresh_frequency(self, *args):
         """Sets autorefresh delay from config."""
         self.auto_refresh_frequency = config['widget-autorefresh-frequency']
-        self.auto_refresh_timer = self.auto_refresh_frequency
+        self.schedule_autorefresh()
 
-    def autorefresh_tick(self, *args):
-        """Called every second to progress the autorefresh."""
-        if self.auto_refresh_frequency <= 0:
-            return
+    def schedule_autorefresh(self):
+        """Schedules the next automatic refresh with the clock daemon."""
+        if self.autorefresh_timer:
+            clock_daemon.unsubscribe(self.autorefresh_timer)
+            self.autorefresh_timer = None
 
-        self.auto_refresh_timer -= 1
-        if self.auto_refresh_timer < 0:
-            for widget in self.widgets:
-                if widget.has_refresh and not widget.disable_autorefresh:
-                    widget.refresh()
-            self.auto_refresh_timer = self.auto_refresh_frequency
+        if self.auto_refresh_frequency > 0:
+            self.autorefresh_timer = clock_daemon.schedule_in(
+                self.auto_refresh_frequency,
+                self.autorefresh_tick,
+                owner=self
+            )
+
+    def autorefresh_tick(self, *args):
+        """Called once the autorefresh delay elapses to refresh all widgets."""
+        self.autorefresh_timer = None
+        for widget in self.widgets:
+            if widget.has_refresh and not widget.disable_autorefresh:
+                # Timed separately, so that slow widgets can be found
+                clock_daemon.call_handler(widget.refresh, owner=widget)
+        self.schedule_autorefresh()
 
     @GObject.Signal(arg_types=(object,))
     def widget_added(self, widget):
@@ -84,10 +84,11 @@ class Launcher(Gtk.ApplicationWindow):
         self.click_controller.connect('released', self.on_focus)
         self.add_controller(self.click_controller)
 
-        self.unfocus_countdown = config['idle-mode-delay'] + 1
-        clock_daemon.connect('notify::time', self.focus_manager_tick)
+        self.unfocus_timer = None
+        self.wallpaper_release_timer = None
+        self.reset_unfocus_timer()
 
-        config.connect('changed::idle-mode-delay', self.update_unfocus_countdown)
+        config.connect('changed::idle-mode-delay', self.reset_unfocus_timer)
 
         self.connect('realize', self.on_realize)
 
@@ -153,42 +154,64 @@ class Launcher(Gtk.ApplicationWindow):
         """Shows the widget chooser."""
         self.widget_chooser.show()
 
-    def update_unfocus_countdown(self, *args):
+    def reset_unfocus_timer(self, *args):
         """
-        Used to update the unfocus countdown value whenever the setting
-        changes.
+        Restarts the countdown until the launcher goes into idle mode.
+        Also used to apply changes to the idle mode delay setting.
         """
-        self.unfocus_countdown = config['idle-mode-delay'] + 1
+        if self.unfocus_timer:
+            clock_daemon.unsubscribe(self.unfocus_timer)
+        self.unfocus_timer = clock_daemon.schedule_in(
+            config['idle-mode-delay'],
+            self.focus_manager_tick,
+            owner=self
+        )
 
     def focus_manager_tick(self, *args):
-        """Called every second to update the focused/unfocused state."""
-        if self.focused and not self.pause_focus_manager:
-            self.unfocus_countdown -= 1
-            if self.unfocus_countdown <= 0:
-                self.on_unfocus()
+        """Called once the idle mode delay elapses to update the focused/unfocused state."""
+        self.unfocus_timer = None
+        if self.pause_focus_manager:
+            self.reset_unfocus_timer()
+        elif self.focused:
+            self.on_unfocus()
 
     def on_unfocus(self, *args):
         """Performs actions on unfocus."""
         if self.focused:
             self.focused = False
-            self.unfocus_countdown = config['idle-mode-delay'] + 1
             self.app_chooser_button_revealer.set_reveal_child(False)
             self.widgetbox.chooser_button_revealer.set_reveal_child(False)
             self.widget_chooser_flap.add_css_class('unfocused')
             self.add_controller(self.motion_controller)
             self.widget_chooser.hide()
 
+            if config['wallpaper-release-delay'] > 0:
+                self.wallpaper_release_timer = clock_daemon.schedule_in(
+                    config['wallpaper-release-delay'],
+                    self.release_wallpaper,
+                    owner=self
+                )
+
+    def release_wallpaper(self, *args):
+        """Releases the wallpaper after some time in idle mode."""
+        self.wallpaper_release_timer = None
+        self.wallpaper.release()
+
     def on_focus(self, *args):
         """Performs actions on focus."""
         if not self.focused:
             self.remove_controller(self.motion_controller)
             self.focused = True
-            self.unfocus_countdown = config['idle-mode-delay'] + 1
+            if self.wallpaper_release_timer:
+                clock_daemon.unsubscribe(self.wallpaper_release_timer)
+                self.wallpaper_release_timer = None
+            self.wallpaper.restore()
+            self.reset_unfocus_timer()
             self.app_chooser_button_revealer.set_reveal_child(True)
             self.widgetbox.chooser_button_revealer.set_reveal_child(True)
             self.widget_chooser_flap.remove_css_class('unfocused')
         else:
-            self.unfocus_countdown = config['idle-mode-delay'] + 1
+            self.reset_unfocus_timer()
 
     def open_settings(self, *args):
         """Opens the launcher settings window."""
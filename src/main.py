@@ -3,12 +3,13 @@
 from gi import require_version as gi_require_version
 gi_require_version("Gtk", "4.0")
 gi_require_version('Adw', '1')
+gi_require_version('Graphene', '1.0')
 import os
-from pathlib import Path
 
 from gi.repository import Adw
 from .launcher.window import Launcher
 from .config import config
+from .utils.wallpaperindex import wallpaper_index
 
 def on_theme_preference_change(*args):
     """Called when the theme preference changes."""
@@ -21,19 +22,26 @@ def on_theme_preference_change(*args):
     else:
         style_manager.set_color_scheme(Adw.ColorScheme.DEFAULT)
 
-def launcher_setup():
-    """Commands that are launched before the launcher window is created."""
-    # Set up default wallpapers
-    if config['available-wallpapers'] and config['available-wallpapers'][0] == 'fixme':
-        wallpaper_files = []
-        wallpaper_paths = []
-        for filetype in ['jpg', 'png']:
-            wallpaper_paths += list(Path('/usr/share/backgrounds').rglob('*.' + filetype))
+def on_wallpapers_added(index, paths):
+    """Adds newly found wallpapers to the available wallpapers."""
+    available_wallpapers = config['available-wallpapers']
+    known_wallpapers = set(available_wallpapers)
+    new_wallpapers = [path for path in paths if path not in known_wallpapers]
+    if new_wallpapers:
+        config['available-wallpapers'] = available_wallpapers + new_wallpapers
 
-        for wallpaper in wallpaper_paths:
-            wallpaper_files.append(str(wallpaper))
-        config['available-wallpapers'] = wallpaper_files
+def on_wallpapers_removed(index, paths):
+    """Removes deleted wallpapers from the available wallpapers."""
+    available_wallpapers = config['available-wallpapers']
+    removed_wallpapers = set(paths)
+    remaining_wallpapers = [
+        path for path in available_wallpapers if path not in removed_wallpapers
+    ]
+    if len(remaining_wallpapers) != len(available_wallpapers):
+        config['available-wallpapers'] = remaining_wallpapers
 
+def on_wallpaper_scan_finished(*args):
+    """Picks the default wallpaper once the wallpaper directories are indexed."""
     if config['wallpaper-path'] == 'fixme':
         wallpaper_files = config['available-wallpapers']
         if wallpaper_files:
@@ -42,6 +50,25 @@ def launcher_setup():
             config['wallpaper-path'] = ''
             config['wallpaper-style'] = 0 # solid color
 
+def on_wallpaper_directories_change(*args):
+    """Applies changes to the list of wallpaper directories."""
+    wallpaper_index.set_directories(config['wallpaper-directories'])
+
+def launcher_setup():
+    """Commands that are launched before the launcher window is created."""
+    # Set up default wallpapers; the wallpaper directories are indexed in
+    # the background, and wallpapers found in them are added as they're found
+    first_run = config['wallpaper-path'] == 'fixme'
+    if config['available-wallpapers'] and config['available-wallpapers'][0] == 'fixme':
+        config['available-wallpapers'] = []
+        first_run = True
+
+    wallpaper_index.connect('wallpapers-added', on_wallpapers_added)
+    wallpaper_index.connect('wallpapers-removed', on_wallpapers_removed)
+    wallpaper_index.connect('scan-finished', on_wallpaper_scan_finished)
+    config.connect('changed::wallpaper-directories', on_wallpaper_directories_change)
+    wallpaper_index.start(config['wallpaper-directories'], first_run=first_run)
+
 class Application(Adw.Application):
     def __init__(self, version='development'):
         super().__init__(application_id='org.dithernet.aspinwall.Launcher',
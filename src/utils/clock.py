@@ -2,45 +2,487 @@
 """
 Contains common code for clock management
 """
-from gi.repository import GObject, GLib
+from gi.repository import Gio, GObject, GLib
+import collections
+import datetime
+import itertools
+import math
+import os
 import time
-import threading
+import traceback
+
+# Intervals that can be passed to ClockDaemon.subscribe()
+EVERY_SECOND = 0
+EVERY_MINUTE = 1
+EVERY_DAY = 2
+
+# strftime directives that change every second/minute. Anything else
+# (weekday, date, etc.) only changes once a day.
+_SECOND_DIRECTIVES = 'ScsTXr+'
+_MINUTE_DIRECTIVES = 'MHIklpPRz'
+
+# Amount of recent call durations kept per handler for percentiles
+STATS_SAMPLES = 1000
+
+# Differences between the wall clock and the monotonic clock above this
+# value (in seconds) are treated as the time jumping (suspend, NTP, etc.)
+JUMP_THRESHOLD = 2.0
+
+# Maximum time (in seconds) between clock daemon wakeups while there are
+# subscribers; this makes sure that time jumps are noticed quickly.
+MAX_TIMEOUT = 60
+
+def get_next_deadline(interval, now):
+    """
+    Returns the time (as a Unix timestamp) at which the given interval
+    next elapses, counting from the provided time.
+    """
+    if interval == EVERY_SECOND:
+        return math.floor(now) + 1
+    elif interval == EVERY_MINUTE:
+        # Minute boundaries are the same in UTC and in all timezones in use
+        return (math.floor(now) // 60 + 1) * 60
+    elif interval == EVERY_DAY:
+        tomorrow = datetime.date.fromtimestamp(now) + datetime.timedelta(days=1)
+        return time.mktime(tomorrow.timetuple())
+    raise ValueError('Unknown clock interval: ' + str(interval))
+
+def get_interval_for_format(format_string):
+    """
+    Returns the longest interval that is still short enough to keep a
+    string formatted with the given strftime format string up-to-date.
+    """
+    directives = format_string.replace('%%', '').split('%')[1:]
+    interval = EVERY_DAY
+    for directive in directives:
+        # Skip glibc flags/field widths, e.g. %-d or %_3H, and the POSIX
+        # E/O modifiers (alternative era/digits), e.g. %Ec or %OM
+        directive = directive.lstrip('-_^#').lstrip('0123456789').lstrip('EO')
+        if not directive:
+            continue
+        if directive[0] in _SECOND_DIRECTIVES:
+            return EVERY_SECOND
+        if directive[0] in _MINUTE_DIRECTIVES:
+            interval = EVERY_MINUTE
+    return interval
+
+def describe_owner(owner):
+    """
+    Returns a human-readable description of a handler's owner. Widgets are
+    described by their ID and instance, so that every instance of a widget
+    gets its own statistics; other owners are described by their class.
+    """
+    if owner is None:
+        return 'unknown'
+    if getattr(owner, 'metadata', None):
+        return owner.metadata['id'] + ' ' + str(owner.instance)
+    return type(owner).__name__
+
+def get_stats_interval():
+    """
+    Returns the interval (in seconds) for printing handler statistics set
+    in the ASPINWALL_CLOCK_STATS environment variable, or 0 if it's unset
+    or invalid.
+    """
+    stats_interval = os.environ.get('ASPINWALL_CLOCK_STATS')
+    if not stats_interval:
+        return 0
+    try:
+        return max(0, int(stats_interval))
+    except ValueError:
+        print('Ignoring invalid ASPINWALL_CLOCK_STATS value: ' + stats_interval)
+        return 0
+
+class HandlerStats:
+    """Contains timing statistics for a single clock daemon handler."""
+
+    def __init__(self, name, owner):
+        """Initializes the handler statistics."""
+        self.name = name
+        self.owner = owner
+        self.calls = 0
+        self.total_time = 0.0
+        self.samples = collections.deque(maxlen=STATS_SAMPLES)
+
+    def add_sample(self, duration):
+        """Records a single call that took the given time (in seconds)."""
+        self.calls += 1
+        self.total_time += duration
+        self.samples.append(duration)
+
+    @property
+    def mean(self):
+        """Mean call duration, in seconds."""
+        if not self.calls:
+            return 0.0
+        return self.total_time / self.calls
+
+    @property
+    def p99(self):
+        """99th percentile of recent call durations, in seconds."""
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[math.ceil(len(samples) * 0.99) - 1]
+
+class ClockSubscription:
+    """Contains information about a single clock daemon subscriber."""
+
+    def __init__(self, handler_id, callback, interval=None, deadline=None, owner=None,
+            relative=False):
+        """Initializes a clock subscription."""
+        self.handler_id = handler_id
+        self.callback = callback
+        # None for one-shot subscriptions created with schedule_at/schedule_in
+        self.interval = interval
+        self.deadline = deadline
+        self.owner = owner
+        # Whether the deadline is relative to the time of subscription
+        # (schedule_in) rather than a point in wall clock time
+        self.relative = relative
+        self.last_call = time.time()
 
 class ClockDaemon(GObject.Object):
     """
     Provides accurate time data for portions of the shell that require it.
 
-    Clients can hook up to the `notify::time` signal to recieve an update
-    whenever the time updates.
+    Clients subscribe to the clock with subscribe() (to be called every
+    second, minute or day) or schedule_at() (to be called once, at a set
+    time). Rather than waking up every second, the daemon keeps a single
+    main loop timeout armed for the nearest deadline of all subscribers.
+
+    Callbacks receive the current time and the time elapsed since their
+    previous call (or since subscribing). If the main loop was blocked,
+    missed updates are delivered as a single call with a longer elapsed
+    time. Changes to the wall clock (resuming from suspend, manual time
+    changes, NTP) cause the `time-jumped` signal to be emitted, followed
+    by an immediate update for all repeating subscribers. The same update
+    happens when the system timezone changes, after the `timezone-changed`
+    signal is emitted.
+
+    The `notify::time` signal is kept for compatibility; while handlers
+    are connected to it, it is emitted every second.
+
+    Every handler call is timed; the results are available through
+    get_handler_stats(). Setting the ASPINWALL_CLOCK_STATS environment
+    variable to a number of seconds prints the statistics periodically.
     """
     __gtype_name__ = 'ClockDaemon'
 
     def __init__(self):
         """Initializes the clock daemon."""
         super().__init__()
-        self.update_thread = threading.Thread(target=self.update_func, daemon=True)
-        self.update_thread.start()
+        self._time = time.time()
+        self._handler_ids = itertools.count(1)
+        self.subscriptions = {}
+
+        self._timeout_id = None
+        self._timeout_deadline = None
+        self._reference_time = (time.time(), time.monotonic())
+
+        self._legacy_handlers = []
+        self._legacy_subscription = None
+
+        self.handler_stats = {}
+        stats_interval = get_stats_interval()
+        if stats_interval:
+            GLib.timeout_add_seconds(stats_interval, self.print_handler_stats)
+
+        # The monotonic clock used by main loop timeouts stops during
+        # suspend, so listen for resumes to update immediately afterwards;
+        # also listen for timezone changes from timedated
+        Gio.bus_get(Gio.BusType.SYSTEM, None, self._on_system_bus)
+
+    def subscribe(self, callback, interval=EVERY_SECOND, owner=None):
+        """
+        Calls the callback every time the given interval (EVERY_SECOND,
+        EVERY_MINUTE or EVERY_DAY) elapses, aligned to the wall clock.
+        The callback receives the current time and the elapsed time
+        since its previous call (both in seconds).
+
+        The owner is the object the subscription belongs to; it is only
+        used for diagnostics. If not set, it is taken from the callback
+        if it is a bound method.
+
+        Returns a handler ID that can be passed to unsubscribe().
+        """
+        handler_id = next(self._handler_ids)
+        self.subscriptions[handler_id] = ClockSubscription(
+            handler_id, callback,
+            interval=interval,
+            deadline=get_next_deadline(interval, time.time()),
+            owner=owner
+        )
+        self._reschedule()
+        return handler_id
+
+    def schedule_at(self, deadline, callback, owner=None):
+        """
+        Calls the callback once, as soon as the provided time (a Unix
+        timestamp) is reached. The callback receives the current time
+        and the elapsed time since scheduling.
+
+        Returns a handler ID that can be passed to unsubscribe().
+        """
+        handler_id = next(self._handler_ids)
+        self.subscriptions[handler_id] = ClockSubscription(
+            handler_id, callback, deadline=deadline, owner=owner
+        )
+        self._reschedule()
+        return handler_id
+
+    def schedule_in(self, delay, callback, owner=None):
+        """
+        Calls the callback once, after the given delay (in seconds).
+        Unlike with schedule_at, setting the clock back does not postpone
+        the call.
+
+        Returns a handler ID that can be passed to unsubscribe().
+        """
+        handler_id = next(self._handler_ids)
+        self.subscriptions[handler_id] = ClockSubscription(
+            handler_id, callback, deadline=time.time() + delay, owner=owner,
+            relative=True
+        )
+        self._reschedule()
+        return handler_id
+
+    def unsubscribe(self, handler_id):
+        """Removes the subscription with the given handler ID."""
+        if self.subscriptions.pop(handler_id, None):
+            self._reschedule()
+
+    def call_handler(self, callback, *args, owner=None):
+        """
+        Calls the callback with the given arguments and records how long
+        the call took. Exceptions raised by the callback are printed and
+        otherwise ignored.
+
+        Subscribers can use this to get separate statistics for work they
+        do on behalf of other objects (e.g. refreshing widgets).
+        """
+        if owner is None:
+            owner = getattr(callback, '__self__', None)
+        name = getattr(callback, '__qualname__', repr(callback))
+        key = (name, describe_owner(owner))
+        stats = self.handler_stats.get(key)
+        if not stats:
+            stats = HandlerStats(*key)
+            self.handler_stats[key] = stats
+
+        start_time = time.perf_counter()
+        try:
+            return callback(*args)
+        except: # noqa: E722
+            traceback.print_exc()
+        finally:
+            stats.add_sample(time.perf_counter() - start_time)
+
+    def forget_owner(self, owner):
+        """
+        Drops the handler statistics of the given owner; called when widgets
+        are destroyed, so that the statistics don't keep growing as widget
+        instances are added and removed.
+        """
+        description = describe_owner(owner)
+        for key in list(self.handler_stats):
+            if key[1] == description:
+                del self.handler_stats[key]
+
+    def get_handler_stats(self):
+        """
+        Returns a list of HandlerStats objects for all handlers called
+        so far, sorted by the total time spent in them (highest first).
+        """
+        return sorted(
+            self.handler_stats.values(),
+            key=lambda stats: stats.total_time,
+            reverse=True
+        )
+
+    def print_handler_stats(self):
+        """Prints the handler statistics to standard output."""
+        print('Clock daemon handler statistics:')
+        print(f'{"calls":>8} {"mean (ms)":>10} {"p99 (ms)":>10}  handler (owner)')
+        for stats in self.get_handler_stats():
+            print(
+                f'{stats.calls:>8} {stats.mean * 1000:>10.3f} {stats.p99 * 1000:>10.3f}  '
+                f'{stats.name} ({stats.owner})'
+            )
+        return True
+
+    def connect(self, detailed_signal, handler, *args):
+        """
+        Connects a signal handler. Handlers for `notify::time` are
+        given a per-second subscription on their behalf, and are timed
+        like regular subscribers.
+        """
+        if detailed_signal == 'notify::time':
+            owner = getattr(handler, '__self__', None)
+            handler_id = super().connect(
+                detailed_signal,
+                lambda *_args: self.call_handler(handler, *_args, owner=owner),
+                *args
+            )
+            self._legacy_handlers.append(handler_id)
+            if not self._legacy_subscription:
+                self._legacy_subscription = self.subscribe(self._notify_time)
+            return handler_id
+        return super().connect(detailed_signal, handler, *args)
+
+    def _notify_time(self, now, *args):
+        """Emits notify::time for legacy subscribers."""
+        self._legacy_handlers = [
+            handler_id for handler_id in self._legacy_handlers
+            if self.handler_is_connected(handler_id)
+        ]
+        if not self._legacy_handlers:
+            self.unsubscribe(self._legacy_subscription)
+            self._legacy_subscription = None
+            return
+        # notify::time handlers are timed separately, so emit it directly
+        self.notify('time')
+
+    def _reschedule(self):
+        """Arms the main loop timeout for the nearest subscriber deadline."""
+        if self.subscriptions:
+            deadline = min(sub.deadline for sub in self.subscriptions.values())
+        else:
+            deadline = None
+
+        if deadline == self._timeout_deadline:
+            return
+
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+        elif deadline is not None:
+            # Time jumps that happened while nothing was scheduled don't matter
+            self._reference_time = (time.time(), time.monotonic())
+        self._timeout_deadline = deadline
+
+        if deadline is not None:
+            # Round up so that we never wake up before the deadline
+            delay = max(0, math.ceil((deadline - time.time()) * 1000))
+            delay = min(delay, MAX_TIMEOUT * 1000)
+            self._timeout_id = GLib.timeout_add(delay, self._dispatch)
+
+    def _get_time_jump(self, now):
+        """
+        Returns the amount of seconds the wall clock has jumped by since
+        the previous check, or 0 if it didn't jump.
+        """
+        monotonic_now = time.monotonic()
+        expected_now = self._reference_time[0] + (monotonic_now - self._reference_time[1])
+        self._reference_time = (now, monotonic_now)
+
+        jump = now - expected_now
+        if abs(jump) < JUMP_THRESHOLD:
+            return 0
+        return jump
 
-    def update_func(self):
+    def _on_system_bus(self, source, result):
+        """Subscribes to logind and timedated signals once the system bus is available."""
+        try:
+            bus = Gio.bus_get_finish(result)
+        except GLib.GError:
+            return
+        bus.signal_subscribe(
+            'org.freedesktop.login1', 'org.freedesktop.login1.Manager',
+            'PrepareForSleep', '/org/freedesktop/login1', None,
+            Gio.DBusSignalFlags.NONE, self._on_prepare_for_sleep
+        )
+        bus.signal_subscribe(
+            'org.freedesktop.timedate1', 'org.freedesktop.DBus.Properties',
+            'PropertiesChanged', '/org/freedesktop/timedate1', None,
+            Gio.DBusSignalFlags.NONE, self._on_timedate_properties_changed
+        )
+
+    def _on_timedate_properties_changed(self, connection, sender, path, interface, signal,
+            parameters):
+        """Reloads the local timezone when the system timezone changes."""
+        interface_name, changed, invalidated = parameters.unpack()
+        if 'Timezone' not in changed and 'Timezone' not in invalidated:
+            return
+        self.update_timezone(changed.get('Timezone', ''))
+
+    def update_timezone(self, timezone_name=''):
         """
-        Infinite loop that updates the clock. This changes the self._time
-        variable every second, which contains the time in the form of a
-        number contains the amount of seconds from the Unix epoch.
+        Reloads the local timezone, emits the `timezone-changed` signal and
+        updates all repeating subscribers.
         """
-        self.set_property('time', time.time())
+        time.tzset()
+        self.emit('timezone-changed', timezone_name)
+
+        now = time.time()
+        for sub in self.subscriptions.values():
+            if sub.interval is not None:
+                sub.deadline = now
+        self._reschedule()
+
+    def _on_prepare_for_sleep(self, connection, sender, path, interface, signal, parameters):
+        """Updates the clock right after resuming from suspend."""
+        going_to_sleep = parameters.unpack()[0]
+        if not going_to_sleep and self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Calls all subscribers whose deadline has passed."""
+        self._timeout_id = None
+        self._timeout_deadline = None
+
+        now = time.time()
+        self._time = now
+
+        jump = self._get_time_jump(now)
+        if jump:
+            for sub in self.subscriptions.values():
+                if sub.interval is not None:
+                    # Update right away; the next deadline is set below
+                    sub.deadline = now
+                elif sub.relative and jump < 0:
+                    sub.deadline += jump
+            self.emit('time-jumped', jump)
 
-        # Sync as close to 0th millisecond as possible
-        start_time = time.time()
-        time.sleep(1 - (time.time() % 1))
+        due = [sub for sub in self.subscriptions.values() if sub.deadline <= now]
+        for sub in due:
+            # Previous callbacks may have removed this subscription
+            if self.subscriptions.get(sub.handler_id) is not sub:
+                continue
 
-        start_time = time.time()
-        while True:
-            GLib.idle_add(lambda *args: self.set_property('time', time.time()))
-            time.sleep(1.0 - ((time.time() - start_time) % 1.0))
+            if sub.interval is None:
+                del self.subscriptions[sub.handler_id]
+            else:
+                sub.deadline = get_next_deadline(sub.interval, now)
+
+            elapsed = now - sub.last_call
+            sub.last_call = now
+            self.call_handler(sub.callback, now, elapsed, owner=sub.owner)
+
+        self._reschedule()
+        return False
+
+    @GObject.Signal(arg_types=(float,))
+    def time_jumped(self, jump):
+        """
+        Emitted when the wall clock jumps, e.g. after resuming from suspend
+        or when the time is changed. The argument contains the size of the
+        jump in seconds (negative if the clock went back).
+        """
+        pass
+
+    @GObject.Signal(arg_types=(str,))
+    def timezone_changed(self, timezone_name):
+        """
+        Emitted when the system timezone changes. The argument contains the
+        identifier of the new timezone, or an empty string if unknown.
+        """
+        pass
 
     @GObject.Property
     def time(self):
-        """The currently stored time."""
+        """The time of the latest clock update."""
         return self._time
 
     @time.setter
@@ -48,3 +490,128 @@ class ClockDaemon(GObject.Object):
         self._time = new_time
 
 clock_daemon = ClockDaemon()
+
+class FormattedTime:
+    """Contains a cached time string for a format string/timezone pair."""
+
+    def __init__(self, format_string, timezone=None):
+        """Initializes the formatted time."""
+        self.format_string = format_string
+        self.timezone = timezone
+        self.interval = get_interval_for_format(format_string)
+        if timezone and self.interval == EVERY_DAY:
+            # Days don't start at local midnight in other timezones
+            self.interval = EVERY_MINUTE
+
+        self.watchers = {}
+        self.clock_subscription = None
+        self.value = None
+        self.update(time.time())
+
+    def format(self, now):
+        """Returns the given time formatted with the format string."""
+        if not self.timezone:
+            return time.strftime(self.format_string, time.localtime(now))
+        return GLib.DateTime.new_from_unix_utc(int(now)).to_timezone(
+            self.timezone
+        ).format(self.format_string)
+
+    def update(self, now, *args):
+        """
+        Re-formats the time and returns True if the resulting string
+        differs from the cached one.
+        """
+        self.valid_until = get_next_deadline(self.interval, now)
+        value = self.format(now)
+        if value == self.value:
+            return False
+        self.value = value
+        return True
+
+class TimeFormatter:
+    """
+    Shared service for keeping formatted time strings up-to-date.
+
+    Strings are cached per (format string, timezone) pair, and are only
+    re-formatted when a time field used in the format can change - once a
+    day for dates, once a minute for hours and minutes. Watchers are only
+    notified when the resulting string actually changes.
+
+    The local timezone uses time.strftime formats; other timezones (passed
+    as GLib.TimeZone objects) use GLib.DateTime.format formats.
+    """
+
+    def __init__(self, clock):
+        """Initializes the time formatter."""
+        self.clock = clock
+        self.entries = {}
+        self._watch_ids = itertools.count(1)
+        self._watches = {}
+        clock.connect('timezone-changed', self.on_timezone_changed)
+
+    def on_timezone_changed(self, *args):
+        """Invalidates strings formatted in the local timezone."""
+        for entry in self.entries.values():
+            if not entry.timezone:
+                entry.valid_until = 0
+
+    def _get_entry(self, format_string, timezone=None):
+        """Returns the cache entry for the format string and timezone."""
+        key = (format_string, timezone.get_identifier() if timezone else None)
+        entry = self.entries.get(key)
+        if not entry:
+            entry = FormattedTime(format_string, timezone)
+            self.entries[key] = entry
+        return entry
+
+    def format(self, format_string, timezone=None):
+        """
+        Returns the current time formatted with the given format string,
+        in the given timezone (or the local timezone if not set).
+        """
+        entry = self._get_entry(format_string, timezone)
+        # Entries without watchers are not kept up-to-date by the clock
+        if not entry.clock_subscription and time.time() >= entry.valid_until:
+            entry.update(time.time())
+        return entry.value
+
+    def watch(self, format_string, callback, timezone=None, owner=None):
+        """
+        Calls the callback with the new string whenever the current time,
+        formatted with the given format string, changes. The current value
+        can be retrieved with format().
+
+        Returns a watch ID that can be passed to unwatch().
+        """
+        entry = self._get_entry(format_string, timezone)
+        watch_id = next(self._watch_ids)
+        entry.watchers[watch_id] = (callback, owner)
+        self._watches[watch_id] = entry
+
+        if not entry.clock_subscription:
+            entry.update(time.time())
+            entry.clock_subscription = self.clock.subscribe(
+                lambda now, *args: self._update_entry(entry, now),
+                entry.interval,
+                owner=self
+            )
+        return watch_id
+
+    def unwatch(self, watch_id):
+        """Stops calling the watcher with the given watch ID."""
+        entry = self._watches.pop(watch_id, None)
+        if not entry:
+            return
+        del entry.watchers[watch_id]
+        if not entry.watchers:
+            self.clock.unsubscribe(entry.clock_subscription)
+            entry.clock_subscription = None
+
+    def _update_entry(self, entry, now):
+        """Updates a watched entry and notifies its watchers of changes."""
+        if not entry.update(now):
+            return
+        for callback, owner in list(entry.watchers.values()):
+            self.clock.call_handler(callback, entry.value, owner=owner)
+
+time_formatter = TimeFormatter(clock_daemon)
@@ -0,0 +1,244 @@
+# coding: utf-8
+"""
+Contains the out-of-process image decoder pool.
+
+Images are decoded by worker processes running this file as a script;
+the decoded pixels are passed back through a memfd (or an unlinked
+temporary file where memfds aren't available), which the launcher maps
+directly into a pixbuf. A crashing image loader only takes down the
+worker, failing the one image it was decoding.
+"""
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, GLib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+
+# Maximum size of a request or response message
+MESSAGE_SIZE = 65536
+# Time (in seconds) after which a worker that hasn't responded is killed
+DECODE_TIMEOUT = 30
+
+def get_decode_size(src_width, src_height, width, height, style, upscale=False):
+    """
+    Returns the smallest size at which an image of the given size still
+    covers a width x height area in the given wallpaper style (1 - fit,
+    anything else - zoom). Images are only enlarged if upscale is True;
+    if the target size is unknown, the original size is returned.
+    """
+    if width <= 0 or height <= 0:
+        return (src_width, src_height)
+
+    if style == 1:
+        factor = min(width / src_width, height / src_height)
+    else:
+        factor = max(width / src_width, height / src_height)
+    if factor >= 1 and not upscale:
+        return (src_width, src_height)
+
+    return (max(1, math.ceil(src_width * factor)), max(1, math.ceil(src_height * factor)))
+
+class DecoderError(Exception):
+    """Raised when a decoder worker fails (crashes, hangs or exits)."""
+    pass
+
+class DecoderWorker:
+    """A decoder worker process, along with the socket used to talk to it."""
+
+    def __init__(self):
+        """Starts the worker process."""
+        self.socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.socket.settimeout(DECODE_TIMEOUT)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(worker_socket.fileno())],
+                pass_fds=[worker_socket.fileno()],
+                stdin=subprocess.DEVNULL
+            )
+        finally:
+            worker_socket.close()
+
+    def decode(self, request):
+        """
+        Sends a decode request to the worker and returns a tuple containing
+        the decoded pixbuf and the original size of the image, or (None, None)
+        if the image can't be decoded. Raises DecoderError if the worker fails.
+        """
+        try:
+            self.socket.send(json.dumps(request).encode('utf-8'))
+            message, fds, flags, address = socket.recv_fds(self.socket, MESSAGE_SIZE, 1)
+        except OSError as e:
+            raise DecoderError(str(e))
+        if not message:
+            raise DecoderError('Decoder worker exited')
+
+        try:
+            response = json.loads(message)
+            if 'error' in response or not fds:
+                return (None, None)
+
+            # The mapping stays alive for as long as the pixbuf uses it
+            data = GLib.MappedFile.new_from_fd(fds[0], False).get_bytes()
+            pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+                data, GdkPixbuf.Colorspace.RGB, response['has_alpha'], 8,
+                response['width'], response['height'], response['rowstride']
+            )
+            return (pixbuf, tuple(response['source_size']))
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def stop(self):
+        """Stops the worker process."""
+        self.socket.close()
+        self.process.kill()
+        self.process.wait()
+
+class DecoderPool:
+    """
+    Pool of decoder worker processes. Workers are started as needed, up to
+    max_workers, and restarted after a failure. Calls to decode() block
+    until a worker is available, so they should be made from threads to
+    decode several images at once.
+
+    The pool is only used while enabled is True; callers decode images
+    in-process otherwise.
+    """
+
+    def __init__(self, max_workers=None):
+        """Initializes the decoder pool."""
+        self.enabled = False
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.workers = []
+        self._semaphore = threading.BoundedSemaphore(self.max_workers)
+        self._lock = threading.Lock()
+
+    def decode(self, path, width=0, height=0, style=1, upscale=False):
+        """
+        Decodes the image at the given path at the size needed to cover a
+        width x height area in the given style (see get_decode_size).
+
+        Returns a tuple containing the decoded pixbuf and the original size
+        of the image, or (None, None) if the image can't be decoded.
+        """
+        request = {
+            'path': path, 'width': width, 'height': height,
+            'style': style, 'upscale': upscale
+        }
+        with self._semaphore:
+            with self._lock:
+                worker = self.workers.pop() if self.workers else None
+            try:
+                if not worker:
+                    worker = DecoderWorker()
+                result = worker.decode(request)
+            except (DecoderError, OSError):
+                traceback.print_exc()
+                if worker:
+                    worker.stop()
+                return (None, None)
+
+            with self._lock:
+                if self.enabled:
+                    self.workers.append(worker)
+                    worker = None
+            if worker:
+                # The pool was shut down while the worker was busy
+                worker.stop()
+            return result
+
+    def shutdown(self):
+        """
+        Disables the pool and stops all idle workers; busy workers are
+        stopped once they finish decoding.
+        """
+        self.enabled = False
+        with self._lock:
+            workers = self.workers
+            self.workers = []
+        for worker in workers:
+            worker.stop()
+
+decoder_pool = DecoderPool()
+
+#
+# Worker process
+#
+
+def create_shared_file():
+    """Returns a file descriptor for passing decoded pixels to the launcher."""
+    if hasattr(os, 'memfd_create'):
+        return os.memfd_create('aspinwall-decoder', os.MFD_CLOEXEC)
+    with tempfile.TemporaryFile() as temp_file:
+        return os.dup(temp_file.fileno())
+
+def decode_request(request):
+    """Decodes an image for a request; returns the response and the pixel fd."""
+    width = request['width']
+    height = request['height']
+
+    def on_size_prepared(loader, src_width, src_height):
+        """Sets the size to decode the image at, based on the header."""
+        source_size.extend((src_width, src_height))
+        loader.set_size(*get_decode_size(
+            src_width, src_height, width, height, request['style'], request['upscale']
+        ))
+
+    source_size = []
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', on_size_prepared)
+    try:
+        loader.write_bytes(GLib.MappedFile.new(request['path'], False).get_bytes())
+    finally:
+        loader.close()
+    pixbuf = loader.get_pixbuf()
+    if not pixbuf:
+        raise ValueError('Could not decode ' + request['path'])
+
+    fd = create_shared_file()
+    try:
+        pixels = pixbuf.read_pixel_bytes().get_data()
+        written = 0
+        while written < len(pixels):
+            written += os.write(fd, pixels[written:])
+    except BaseException:
+        os.close(fd)
+        raise
+
+    response = {
+        'width': pixbuf.get_width(),
+        'height': pixbuf.get_height(),
+        'rowstride': pixbuf.get_rowstride(),
+        'has_alpha': pixbuf.get_has_alpha(),
+        'source_size': source_size
+    }
+    return (response, fd)
+
+def run_worker(fd):
+    """Handles decode requests sent through the given socket until it's closed."""
+    worker_socket = socket.socket(fileno=fd)
+    while True:
+        message = worker_socket.recv(MESSAGE_SIZE)
+        if not message:
+            break
+
+        try:
+            response, pixel_fd = decode_request(json.loads(message))
+        except (GLib.GError, OSError, ValueError, KeyError) as e:
+            worker_socket.send(json.dumps({'error': str(e)}).encode('utf-8'))
+            continue
+
+        try:
+            socket.send_fds(worker_socket, [json.dumps(response).encode('utf-8')], [pixel_fd])
+        finally:
+            os.close(pixel_fd)
+
+if __name__ == '__main__':
+    run_worker(int(sys.argv[1]))
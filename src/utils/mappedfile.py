@@ -0,0 +1,57 @@
+# coding: utf-8
+"""
+Contains a shared cache of memory-mapped files.
+"""
+from gi.repository import GLib
+from collections import OrderedDict
+import os
+import threading
+
+# Amount of files to keep mapped
+MAX_MAPPED_FILES = 8
+
+class MappedFileCache:
+    """
+    Keeps recently read files memory-mapped, so that reading the same file
+    again (for example, a wallpaper decoded for the launcher, the settings
+    preview and the wallpaper grid) reuses the mapping, and with it the
+    page cache, instead of reading the file through a new buffer.
+
+    Mappings are replaced once the modification time or size of the file
+    changes.
+    """
+
+    def __init__(self, max_files=MAX_MAPPED_FILES):
+        """Initializes the mapped file cache."""
+        self.max_files = max_files
+        self.files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_bytes(self, path):
+        """
+        Returns the contents of the file as a GLib.Bytes object backed by
+        the mapping. Raises GLib.GError if the file can't be mapped.
+        """
+        try:
+            stat = os.stat(path)
+            file_id = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            # Let GLib.MappedFile raise the error
+            file_id = None
+
+        with self._lock:
+            mapped = self.files.get(path)
+            if mapped and file_id and mapped[0] == file_id:
+                self.files.move_to_end(path)
+                return mapped[1]
+
+        data = GLib.MappedFile.new(path, False).get_bytes()
+
+        with self._lock:
+            self.files[path] = (file_id, data)
+            self.files.move_to_end(path)
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+        return data
+
+mapped_files = MappedFileCache()
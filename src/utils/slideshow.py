@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+Contains the slideshow playlist.
+"""
+import random
+
+class SlideshowPlaylist:
+    """
+    Precomputed order in which the slideshow displays wallpapers.
+
+    The order for the current cycle is generated once per cycle, along
+    with a lookup table of wallpaper positions, so advancing to the next
+    wallpaper or jumping to a specific one doesn't need to search the
+    wallpaper list. In the weighted order, a wallpaper can appear several
+    times per cycle; the position is what tells these occurrences apart.
+
+    Supported orders:
+      - ORDER_SEQUENTIAL - wallpapers in the order they were added in.
+      - ORDER_SHUFFLE - a random permutation of the wallpapers; the
+                        permutation is derived from the cycle number, so
+                        it stays the same for the entire cycle (including
+                        across restarts).
+      - ORDER_WEIGHTED - every wallpaper appears as many times per cycle as
+                         its weight, evenly spread out over the cycle.
+    """
+    ORDER_SEQUENTIAL = 0
+    ORDER_SHUFFLE = 1
+    ORDER_WEIGHTED = 2
+
+    def __init__(self, wallpapers, order=ORDER_SEQUENTIAL, weights=None, cycle=0):
+        """Initializes the playlist."""
+        self.wallpapers = list(wallpapers)
+        self.order_type = order
+        self.weights = weights or {}
+        self.cycle = cycle
+        self.position = -1
+        self._next_cycle_order = None
+        self.order = self.generate(cycle)
+        self._update_positions()
+
+    def get_weight(self, wallpaper):
+        """
+        Returns the number of times the wallpaper appears per cycle; weights
+        only apply to the weighted order.
+        """
+        if self.order_type != self.ORDER_WEIGHTED:
+            return 1
+        return max(1, self.weights.get(wallpaper, 1))
+
+    def generate(self, cycle):
+        """Returns the wallpaper order for the given cycle."""
+        if self.order_type == self.ORDER_SHUFFLE:
+            order = self.wallpapers.copy()
+            random.Random(cycle).shuffle(order)
+            return order
+
+        elif self.order_type == self.ORDER_WEIGHTED:
+            # Spread the occurrences of each wallpaper evenly over the cycle,
+            # with a random offset so that equal weights don't clump up
+            rng = random.Random(cycle)
+            occurrences = []
+            for wallpaper in self.wallpapers:
+                weight = self.get_weight(wallpaper)
+                offset = rng.random()
+                for n in range(weight):
+                    occurrences.append(((n + offset) / weight, wallpaper))
+            occurrences.sort(key=lambda occurrence: occurrence[0])
+            return [occurrence[1] for occurrence in occurrences]
+
+        return self.wallpapers.copy()
+
+    def _update_positions(self):
+        """Rebuilds the wallpaper position lookup table."""
+        self.positions = {}
+        for position, wallpaper in enumerate(self.order):
+            self.positions.setdefault(wallpaper, []).append(position)
+
+    def _get_next_cycle_order(self):
+        """Returns the (cached) order of the next cycle."""
+        if self._next_cycle_order is None:
+            self._next_cycle_order = self.generate(self.cycle + 1)
+        return self._next_cycle_order
+
+    @property
+    def current(self):
+        """The wallpaper at the current position, or None."""
+        if 0 <= self.position < len(self.order):
+            return self.order[self.position]
+        return None
+
+    def peek(self):
+        """Returns the wallpaper that advance() would return next."""
+        if not self.order:
+            return None
+        if self.position + 1 < len(self.order):
+            return self.order[self.position + 1]
+        return self._get_next_cycle_order()[0]
+
+    def advance(self):
+        """
+        Moves to the next wallpaper and returns it, starting a new cycle
+        once the end of the current one is reached.
+        """
+        if not self.order:
+            return None
+        self.position += 1
+        if self.position >= len(self.order):
+            self.order = self._get_next_cycle_order()
+            self._next_cycle_order = None
+            self.cycle += 1
+            self.position = 0
+            self._update_positions()
+        return self.order[self.position]
+
+    def seek(self, wallpaper, position=None):
+        """
+        Moves to the given wallpaper, so that the playlist continues from
+        it. If the wallpaper appears more than once in the current cycle,
+        the occurrence closest to position is used (the first one if no
+        position is given). Unknown wallpapers restart the cycle from the
+        beginning.
+        """
+        positions = self.positions.get(wallpaper)
+        if not positions:
+            self.position = -1
+        elif position is None:
+            self.position = positions[0]
+        else:
+            self.position = min(positions, key=lambda p: abs(p - position))
+
+    def set_order(self, order, weights=None):
+        """Changes the order type and weights, keeping the current wallpaper."""
+        current = self.current
+        self.order_type = order
+        self.weights = weights or {}
+        self.order = self.generate(self.cycle)
+        self._next_cycle_order = None
+        self._update_positions()
+        self.seek(current)
+
+    def update_wallpapers(self, wallpapers):
+        """
+        Updates the playlist after wallpapers were added, removed or
+        reordered, keeping the current wallpaper and the order of the
+        ones already played.
+        """
+        current = self.current
+        old_wallpapers = set(self.wallpapers)
+        new_wallpapers = set(wallpapers)
+        played_count = len([
+            wallpaper for wallpaper in self.order[:self.position + 1]
+            if wallpaper in new_wallpapers
+        ])
+        self.wallpapers = list(wallpapers)
+        self._next_cycle_order = None
+
+        if self.order_type == self.ORDER_SEQUENTIAL:
+            self.order = self.wallpapers.copy()
+        else:
+            played = [
+                wallpaper for wallpaper in self.order[:self.position + 1]
+                if wallpaper in new_wallpapers
+            ]
+            remaining = [
+                wallpaper for wallpaper in self.order[self.position + 1:]
+                if wallpaper in new_wallpapers
+            ]
+            # New wallpapers are mixed into the rest of the current cycle
+            for wallpaper in self.wallpapers:
+                if wallpaper not in old_wallpapers:
+                    remaining += [wallpaper] * self.get_weight(wallpaper)
+            random.Random(self.cycle).shuffle(remaining)
+            self.order = played + remaining
+
+        self._update_positions()
+        if self.order_type == self.ORDER_SEQUENTIAL and current in new_wallpapers:
+            self.seek(current)
+        else:
+            # Continue after the last played wallpaper (the current one, unless
+            # it was removed); seeking to the current wallpaper could jump back
+            # to an earlier occurrence of it in the weighted order
+            self.position = min(played_count, len(self.order)) - 1
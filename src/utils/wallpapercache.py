@@ -0,0 +1,282 @@
+# coding: utf-8
+"""
+Contains the on-disk and in-memory caches of rendered wallpapers.
+"""
+from gi.repository import Gdk, GLib
+from collections import OrderedDict
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import traceback
+
+cache_dir = os.path.join(GLib.get_user_cache_dir(), 'aspinwall', 'wallpapers')
+
+# Magic, version, width, height, rowstride, has alpha, source width, source height
+HEADER_FORMAT = '<4sIIIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CACHE_MAGIC = b'AWPC'
+CACHE_VERSION = 1
+
+class WallpaperCache:
+    """
+    Cache of rendered (scaled) wallpapers, stored in the XDG cache directory.
+
+    Entries are keyed by the source file (path, modification time and size),
+    the target size and the wallpaper style. Pixels are stored uncompressed,
+    right after a small header, so that entries can be memory-mapped and
+    turned into a texture without decoding or copying them.
+
+    Entries are evicted in least-recently-used order once the cache grows
+    beyond max_size (in bytes); a max_size of 0 disables the cache.
+    """
+
+    def __init__(self, path=cache_dir, max_size=0):
+        """Initializes the wallpaper cache."""
+        self.path = path
+        self.max_size = max_size
+        self._evict_lock = threading.Lock()
+
+    def get_key(self, wallpaper_path, width, height, style, span=None):
+        """
+        Returns the cache key for the given wallpaper rendered at the given
+        size and style (and, for spanned wallpapers, monitor geometry), or
+        None if the wallpaper file can't be accessed.
+        """
+        try:
+            stat = os.stat(wallpaper_path)
+        except OSError:
+            return None
+        key_data = '\0'.join((
+            wallpaper_path, str(stat.st_mtime_ns), str(stat.st_size),
+            str(width), str(height), str(style)
+        ) + ((str(span),) if span else ()))
+        return hashlib.sha256(key_data.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get_entry_path(self, key):
+        """Returns the path of the cache entry with the given key."""
+        return os.path.join(self.path, key + '.cache')
+
+    def lookup(self, key):
+        """
+        Returns a tuple containing the cached texture and the size of the
+        source image, or None if the entry is not in the cache.
+        """
+        if not self.max_size or not key:
+            return None
+
+        entry_path = self.get_entry_path(key)
+        try:
+            data = GLib.MappedFile.new(entry_path, False).get_bytes()
+        except GLib.GError:
+            return None
+
+        try:
+            size = data.get_size()
+            if size < HEADER_SIZE:
+                raise ValueError('truncated header')
+            header = GLib.Bytes.new_from_bytes(data, 0, HEADER_SIZE).get_data()
+            magic, version, width, height, rowstride, has_alpha, src_width, src_height = \
+                struct.unpack(HEADER_FORMAT, header)
+            bytes_per_pixel = 4 if has_alpha else 3
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                raise ValueError('unknown format')
+            if not width or not height or \
+                    size - HEADER_SIZE < (height - 1) * rowstride + width * bytes_per_pixel:
+                raise ValueError('truncated data')
+        except ValueError:
+            traceback.print_exc()
+            self.remove(key)
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        pixels = GLib.Bytes.new_from_bytes(data, HEADER_SIZE, size - HEADER_SIZE)
+        if has_alpha:
+            memory_format = Gdk.MemoryFormat.R8G8B8A8
+        else:
+            memory_format = Gdk.MemoryFormat.R8G8B8
+        texture = Gdk.MemoryTexture.new(width, height, memory_format, pixels, rowstride)
+        return (texture, (src_width, src_height))
+
+    def store(self, key, pixbuf, source_size):
+        """
+        Stores a rendered wallpaper in the cache, then evicts old entries
+        if needed. Safe to call from other threads.
+        """
+        if not self.max_size or not key or not pixbuf:
+            return
+
+        header = struct.pack(
+            HEADER_FORMAT, CACHE_MAGIC, CACHE_VERSION,
+            pixbuf.get_width(), pixbuf.get_height(), pixbuf.get_rowstride(),
+            int(pixbuf.get_has_alpha()), *source_size
+        )
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Write to a temporary file first, so that the entry is replaced
+            # atomically; mapped copies of the old entry stay valid
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(header)
+                    temp_file.write(pixbuf.read_pixel_bytes().get_data())
+                os.replace(temp_path, self.get_entry_path(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            traceback.print_exc()
+            return
+
+        self.evict()
+
+    def remove(self, key):
+        """Removes the entry with the given key from the cache."""
+        try:
+            os.unlink(self.get_entry_path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_size."""
+        with self._evict_lock:
+            entries = []
+            total_size = 0
+            try:
+                with os.scandir(self.path) as files:
+                    for entry in files:
+                        if not entry.name.endswith('.cache'):
+                            continue
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total_size += stat.st_size
+            except OSError:
+                return
+
+            entries.sort()
+            for mtime, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total_size -= size
+
+class WallpaperMemoryCache:
+    """
+    Process-wide cache of loaded wallpapers, shared by all Wallpaper objects
+    and the slideshow prefetch.
+
+    Entries are tuples of (decoded image, original image size, rendered
+    texture), keyed by the source file, target size and wallpaper style
+    (see get_key). Least recently used entries are dropped once the total
+    size of the entries exceeds max_size (in bytes).
+
+    If an entry is requested while another thread is already loading it,
+    the request waits for that load instead of loading it again.
+    """
+
+    def __init__(self, max_size=0):
+        """Initializes the memory cache."""
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_size = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_key(self, wallpaper_path, width, height, style, is_preview=False, span=None):
+        """Returns the cache key for the given wallpaper variant."""
+        try:
+            mtime = os.stat(wallpaper_path).st_mtime_ns
+        except (OSError, TypeError, ValueError):
+            mtime = None
+        return (wallpaper_path, mtime, width, height, style, is_preview, span)
+
+    def get_entry_size(self, entry):
+        """Returns the approximate amount of memory taken up by an entry."""
+        image, image_size, texture = entry
+        size = 0
+        if image:
+            size += image.get_byte_length()
+        if texture:
+            size += texture.get_width() * texture.get_height() * 4
+        return size
+
+    def lookup(self, key):
+        """Returns the entry with the given key, or None if it's not cached."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+            return entry
+
+    def get(self, key, load_func):
+        """
+        Returns the entry with the given key, calling load_func to create
+        it if it's not in the cache. Entries where load_func returned no
+        image or texture (for example, because loading was cancelled) aren't
+        cached.
+        """
+        while True:
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry:
+                    self.entries.move_to_end(key)
+                    return entry
+                pending = self._pending.get(key)
+                if not pending:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            entry = load_func()
+            if entry[0] or entry[2]:
+                self.store(key, entry)
+            return entry
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def store(self, key, entry):
+        """Adds an entry to the cache, evicting old entries if needed."""
+        entry_size = self.get_entry_size(entry)
+        with self._lock:
+            self._remove(key)
+            if entry_size > self.max_size:
+                return
+            self.entries[key] = entry
+            self.sizes[key] = entry_size
+            self.total_size += entry_size
+            while self.total_size > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Removes the entry with the given key from the cache, if it's cached."""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        """Removes an entry; must be called with the lock held."""
+        if key in self.entries:
+            del self.entries[key]
+            self.total_size -= self.sizes.pop(key)
+
+    def set_max_size(self, max_size):
+        """Sets the maximum size of the cache and evicts entries to fit in it."""
+        with self._lock:
+            self.max_size = max_size
+            while self.total_size > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+wallpaper_cache = WallpaperCache()
+wallpaper_memory_cache = WallpaperMemoryCache()
@@ -0,0 +1,344 @@
+# coding: utf-8
+"""
+Contains the index of wallpapers found in the wallpaper directories.
+"""
+from gi.repository import GdkPixbuf, Gio, GLib, GObject
+import json
+import os
+import tempfile
+import threading
+import traceback
+
+index_path = os.path.join(GLib.get_user_cache_dir(), 'aspinwall', 'wallpaper-index.json')
+
+INDEX_VERSION = 1
+
+# Extensions of files that are picked up as wallpapers
+WALLPAPER_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif', '.svg')
+
+# Time (in miliseconds) to wait for more file changes before indexing them
+UPDATE_DELAY = 500
+
+def is_wallpaper_file(path):
+    """Returns True if the file has one of the supported wallpaper extensions."""
+    return path.lower().endswith(WALLPAPER_EXTENSIONS)
+
+def is_in_directory(path, directory):
+    """Returns True if the path is the given directory or is inside of it."""
+    return path == directory or path.startswith(directory.rstrip('/') + '/')
+
+def is_in_paths(path, paths):
+    """
+    Returns True if the path is one of the given paths (a set) or is inside
+    of one of them; only the parents of the path are looked up, so that
+    this stays fast for large sets.
+    """
+    while path not in paths:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return True
+
+def probe_file(path, stat):
+    """
+    Returns an index entry for the file at the given path: its modification
+    time, width, height and format name. Only the image header is read.
+    Files that can't be loaded get an entry with no format, so that they
+    aren't probed again until they change.
+    """
+    try:
+        image_format, width, height = GdkPixbuf.Pixbuf.get_file_info(path)
+    except GLib.GError:
+        image_format = None
+    if not image_format:
+        return [stat.st_mtime_ns, 0, 0, None]
+    return [stat.st_mtime_ns, width, height, image_format.get_name()]
+
+def scan_paths(paths, known_files):
+    """
+    Indexes the wallpapers in the given paths (files or directories, which
+    are scanned recursively). Entries from known_files are reused for files
+    that haven't changed since they were indexed.
+
+    Returns a tuple containing a dict of index entries for all wallpapers
+    that were found and a set of the directories that were scanned.
+    """
+    files = {}
+    directories = set()
+    for path in paths:
+        if not os.path.isdir(path):
+            try:
+                if is_wallpaper_file(path):
+                    stat = os.stat(path)
+                    known = known_files.get(path)
+                    if known and known[0] == stat.st_mtime_ns:
+                        files[path] = known
+                    else:
+                        files[path] = probe_file(path, stat)
+            except OSError:
+                pass
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            directories.add(dirpath)
+            for filename in filenames:
+                if not is_wallpaper_file(filename):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                known = known_files.get(file_path)
+                if known and known[0] == stat.st_mtime_ns:
+                    files[file_path] = known
+                else:
+                    files[file_path] = probe_file(file_path, stat)
+
+    return (files, directories)
+
+class WallpaperIndex(GObject.Object):
+    """
+    Index of the wallpapers found in the wallpaper directories.
+
+    The directories are scanned in a separate thread; the index (path,
+    modification time, dimensions and format of each file) is stored in
+    the XDG cache directory, so that only new or changed files have to be
+    probed on the next start. Afterwards, the index is kept up-to-date
+    with file monitors, without rescanning the directories.
+
+    Wallpapers that appear in or disappear from the directories are
+    announced through the `wallpapers-added` and `wallpapers-removed`
+    signals.
+    """
+    __gtype_name__ = 'WallpaperIndex'
+
+    def __init__(self, path=index_path):
+        """Initializes the wallpaper index."""
+        super().__init__()
+        self.path = path
+        self.directories = []
+        self.files = {}
+        self.monitors = {}
+        self.loaded = False
+
+        self._pending_paths = set()
+        self._pending_source = None
+        self._save_lock = threading.Lock()
+
+    def start(self, directories, first_run=False):
+        """
+        Loads the stored index and scans the given directories in the
+        background. If first_run is True, the stored index is ignored and
+        all wallpapers found are announced as new. If there is no stored
+        index otherwise, the wallpapers found are added to the index
+        without being announced.
+        """
+        self.directories = list(directories)
+        scan_thread = threading.Thread(
+            target=self._start, args=[self.directories, first_run], daemon=True
+        )
+        scan_thread.start()
+
+    def _start(self, directories, first_run):
+        """Loads the index and scans the directories; runs in the scan thread."""
+        stored_files = None
+        if not first_run:
+            stored_files = self.load()
+        files, scanned_directories = scan_paths(directories, stored_files or {})
+        GLib.idle_add(
+            self._finish_start, stored_files, directories, files, scanned_directories,
+            first_run or stored_files is not None
+        )
+
+    def _finish_start(self, stored_files, directories, files, scanned_directories, announce):
+        """Applies the results of the initial scan."""
+        self.files = stored_files or {}
+        self.loaded = True
+        # Drop wallpapers from directories that were removed since the last run
+        stale_paths = [
+            path for path in self.files
+            if not any(is_in_directory(path, d) for d in directories)
+        ]
+        self.apply_scan(directories + stale_paths, files, scanned_directories, announce)
+
+        # Apply changes to the directories made while the scan was running
+        new_directories = self.directories
+        self.directories = list(directories)
+        self.set_directories(new_directories)
+        self.emit('scan-finished')
+        return False
+
+    def load(self):
+        """Returns the files from the stored index, or None if there is none."""
+        try:
+            with open(self.path, 'r') as index_file:
+                index = json.load(index_file)
+            if index.get('version') != INDEX_VERSION:
+                return None
+            return index['files']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, AttributeError):
+            traceback.print_exc()
+            return None
+
+    def save(self):
+        """Stores the index in a separate thread."""
+        save_thread = threading.Thread(
+            target=self._save, args=[dict(self.files)], daemon=True
+        )
+        save_thread.start()
+
+    def _save(self, files):
+        """Writes the index to disk; runs in the save thread."""
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.path), suffix='.tmp'
+                )
+                try:
+                    with os.fdopen(fd, 'w') as temp_file:
+                        json.dump({'version': INDEX_VERSION, 'files': files}, temp_file)
+                    os.replace(temp_path, self.path)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+            except OSError:
+                traceback.print_exc()
+
+    def set_directories(self, directories):
+        """
+        Changes the indexed directories. Wallpapers in directories that are
+        no longer indexed are removed, and new directories are scanned. If
+        the initial scan is still running, the changes are applied once it
+        finishes.
+        """
+        if not self.loaded:
+            self.directories = list(directories)
+            return
+
+        removed = [d for d in self.directories if d not in directories]
+        added = [d for d in directories if d not in self.directories]
+        self.directories = list(directories)
+        if removed:
+            self.apply_scan(removed, {}, set())
+        if added:
+            self.queue_update(added)
+
+    def get_wallpapers(self):
+        """Returns the paths of all indexed wallpapers, sorted."""
+        return sorted(path for path, entry in self.files.items() if entry[3])
+
+    def queue_update(self, paths):
+        """
+        Queues the given paths to be re-indexed; updates are collected for
+        a short while, then indexed together in a separate thread.
+        """
+        self._pending_paths.update(paths)
+        if not self._pending_source:
+            self._pending_source = GLib.timeout_add(UPDATE_DELAY, self._update)
+
+    def _update(self):
+        """Starts indexing the queued paths."""
+        self._pending_source = None
+        # Skip paths that are no longer inside of an indexed directory
+        paths = [
+            path for path in self._pending_paths
+            if any(is_in_directory(path, d) for d in self.directories)
+        ]
+        self._pending_paths.clear()
+        if paths:
+            update_thread = threading.Thread(
+                target=self._scan, args=[paths, dict(self.files)], daemon=True
+            )
+            update_thread.start()
+        return False
+
+    def _scan(self, paths, known_files):
+        """Indexes the given paths; runs in the update thread."""
+        files, directories = scan_paths(paths, known_files)
+        GLib.idle_add(self._finish_scan, paths, files, directories)
+
+    def _finish_scan(self, paths, files, directories):
+        """Applies the results of an update."""
+        self.apply_scan(paths, files, directories)
+        return False
+
+    def apply_scan(self, paths, files, directories, announce=True):
+        """
+        Replaces the index entries for the given paths with the scanned
+        files, updates the file monitors and stores the index.
+
+        Only files that weren't indexed as wallpapers before are announced
+        as added; changes to a known wallpaper (for example, one the user
+        removed from the available wallpapers) don't announce it again.
+        """
+        added = []
+        removed = []
+        paths = set(os.path.normpath(path) for path in paths)
+        for path in list(self.files):
+            if path not in files and is_in_paths(path, paths):
+                if self.files.pop(path)[3]:
+                    removed.append(path)
+        for path, entry in files.items():
+            old_entry = self.files.get(path)
+            if entry[3] and not (old_entry and old_entry[3]):
+                added.append(path)
+            self.files[path] = entry
+
+        for directory in list(self.monitors):
+            if directory not in directories and is_in_paths(directory, paths):
+                self.monitors.pop(directory).cancel()
+        for directory in directories:
+            if directory not in self.monitors:
+                self.add_monitor(directory)
+
+        self.save()
+        if added and announce:
+            self.emit('wallpapers-added', sorted(added))
+        if removed:
+            self.emit('wallpapers-removed', removed)
+
+    def add_monitor(self, directory):
+        """Starts watching the given directory for changes."""
+        try:
+            monitor = Gio.File.new_for_path(directory).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None
+            )
+        except GLib.GError:
+            traceback.print_exc()
+            return
+        monitor.connect('changed', self.on_directory_changed)
+        self.monitors[directory] = monitor
+
+    def on_directory_changed(self, monitor, file, other_file, event_type):
+        """Queues changed files and directories to be re-indexed."""
+        if event_type in (
+                Gio.FileMonitorEvent.CREATED,
+                Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                Gio.FileMonitorEvent.DELETED,
+                Gio.FileMonitorEvent.MOVED_IN,
+                Gio.FileMonitorEvent.MOVED_OUT):
+            self.queue_update([file.get_path()])
+        elif event_type == Gio.FileMonitorEvent.RENAMED:
+            self.queue_update([file.get_path(), other_file.get_path()])
+
+    @GObject.Signal(arg_types=(object,))
+    def wallpapers_added(self, paths):
+        """Emitted with a list of paths when new wallpapers are found."""
+        pass
+
+    @GObject.Signal(arg_types=(object,))
+    def wallpapers_removed(self, paths):
+        """Emitted with a list of paths when indexed wallpapers disappear."""
+        pass
+
+    @GObject.Signal
+    def scan_finished(self):
+        """Emitted once the initial scan of the wallpaper directories is done."""
+        pass
+
+wallpaper_index = WallpaperIndex()
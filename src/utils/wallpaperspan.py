@@ -0,0 +1,46 @@
+# coding: utf-8
+"""
+Contains the geometry calculations for wallpapers spanned across monitors.
+"""
+import math
+
+def get_monitor_span(geometries, geometry, scales):
+    """
+    Returns a tuple describing the part of the monitor layout covered by a
+    monitor when a wallpaper is spanned across all monitors: the size of
+    the layout, the position and size of the monitor in it (all in logical
+    pixels) and the scale the shared image is decoded at, which is the
+    highest monitor scale, so that it's sharp on every monitor.
+
+    geometries contains the (x, y, width, height) of all monitors, geometry
+    that of the monitor the wallpaper is on, and scales the (possibly
+    fractional) scales of all monitors.
+    """
+    left = min(x for x, y, width, height in geometries)
+    top = min(y for x, y, width, height in geometries)
+    right = max(x + width for x, y, width, height in geometries)
+    bottom = max(y + height for x, y, width, height in geometries)
+    x, y, width, height = geometry
+    return (right - left, bottom - top, x - left, y - top, width, height, max(scales))
+
+def get_span_source_size(span):
+    """Returns the size (in device pixels) spanned wallpapers are decoded at."""
+    layout_width, layout_height, x, y, width, height, scale = span
+    return (math.ceil(layout_width * scale), math.ceil(layout_height * scale))
+
+def get_span_crop(image_width, image_height, span):
+    """
+    Returns the part (x, y, width, height) of an image spanned across all
+    monitors that is shown on the monitor described by the span. The image
+    is zoomed to cover the whole monitor layout.
+    """
+    layout_width, layout_height, x, y, width, height, scale = span
+    factor = max(layout_width / image_width, layout_height / image_height)
+    offset_x = (image_width * factor - layout_width) / 2
+    offset_y = (image_height * factor - layout_height) / 2
+
+    crop_x = min(image_width - 1, max(0, math.floor((x + offset_x) / factor)))
+    crop_y = min(image_height - 1, max(0, math.floor((y + offset_y) / factor)))
+    crop_width = max(1, min(image_width - crop_x, math.ceil(width / factor)))
+    crop_height = max(1, min(image_height - crop_y, math.ceil(height / factor)))
+    return (crop_x, crop_y, crop_width, crop_height)
@@ -9,6 +9,8 @@ import os
 import gettext
 import re
 
+from ..utils.clock import clock_daemon
+
 class Widget(GObject.GObject):
     """
     Base class for Aspinwall widgets.
@@ -104,6 +106,8 @@ class Widget(GObject.GObject):
 
     def destroy(self):
         """Cleans up after the widget is removed."""
+        clock_daemon.forget_owner(self)
+
         if self.has_config:
             for key in self.settings_schema.list_keys():
                 self.config.reset(key)
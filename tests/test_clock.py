@@ -0,0 +1,185 @@
+# coding: utf-8
+"""
+Contains tests for the clock daemon.
+"""
+from gi.repository import GLib
+import time
+
+from aspinwall_launcher.utils.clock import (
+    ClockDaemon, TimeFormatter,
+    EVERY_SECOND, EVERY_MINUTE, EVERY_DAY,
+    get_interval_for_format,
+    get_stats_interval,
+    get_next_deadline
+)
+
+def iterate_until(condition, timeout=5):
+    """Runs the main loop until the condition is met or the timeout passes."""
+    context = GLib.MainContext.default()
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        context.iteration(False)
+        time.sleep(0.01)
+    return condition()
+
+def test_next_deadline():
+    """Tests deadline calculation for subscription intervals."""
+    now = 1000000.5
+    assert get_next_deadline(EVERY_SECOND, now) == 1000001
+    assert get_next_deadline(EVERY_MINUTE, now) == 1000020
+
+    next_day = get_next_deadline(EVERY_DAY, now)
+    assert next_day > now
+    assert time.localtime(next_day).tm_hour == 0
+    assert time.localtime(next_day).tm_min == 0
+
+def test_interval_for_format():
+    """Tests guessing the update interval from strftime format strings."""
+    assert get_interval_for_format('%H:%M:%S') == EVERY_SECOND
+    assert get_interval_for_format('%H:%M') == EVERY_MINUTE
+    assert get_interval_for_format('%-I:%M %p') == EVERY_MINUTE
+    assert get_interval_for_format('%A, %x') == EVERY_DAY
+    assert get_interval_for_format('100%% %d') == EVERY_DAY
+    # E/O modifiers
+    assert get_interval_for_format('%OH:%OM') == EVERY_MINUTE
+    assert get_interval_for_format('%Ec') == EVERY_SECOND
+    assert get_interval_for_format('%OS') == EVERY_SECOND
+    assert get_interval_for_format('%Ex') == EVERY_DAY
+    assert get_interval_for_format('%_3OM') == EVERY_MINUTE
+
+def test_schedule_at():
+    """Tests one-shot callbacks and unsubscribing."""
+    clock = ClockDaemon()
+    calls = []
+    deadline = time.time() + 0.1
+    clock.schedule_at(deadline, lambda now, elapsed: calls.append(now))
+    cancelled = clock.schedule_at(deadline, lambda now, elapsed: calls.append(None))
+    clock.unsubscribe(cancelled)
+
+    assert iterate_until(lambda: calls)
+    assert None not in calls
+    # Callbacks are never called before their deadline
+    assert calls[0] >= deadline
+    assert not clock.subscriptions
+
+def test_subscribe():
+    """Tests repeating subscriptions."""
+    clock = ClockDaemon()
+    calls = []
+    handler_id = clock.subscribe(lambda now, elapsed: calls.append(now), EVERY_SECOND)
+    assert iterate_until(lambda: len(calls) >= 2, timeout=5)
+    # Callbacks are aligned to the start of each second
+    assert calls[1] - calls[0] >= 0.9
+    assert calls[1] % 1 < 0.5
+
+    clock.unsubscribe(handler_id)
+    assert not clock.subscriptions
+
+def test_handler_stats():
+    """Tests handler timing statistics."""
+    clock = ClockDaemon()
+
+    def slow_handler(*args):
+        time.sleep(0.01)
+
+    def failing_handler(*args):
+        raise ValueError()
+
+    for i in range(3):
+        clock.call_handler(slow_handler, owner=clock)
+    clock.call_handler(failing_handler)
+
+    stats = clock.get_handler_stats()
+    assert len(stats) == 2
+    assert stats[0].name.endswith('slow_handler')
+    assert stats[0].owner.startswith('ClockDaemon')
+    assert stats[0].calls == 3
+    assert stats[0].mean >= 0.01
+    assert stats[0].p99 >= stats[0].mean * 0.5
+    assert stats[1].owner == 'unknown'
+    assert stats[1].calls == 1
+
+    # Owners of the same class share their statistics
+    clock.call_handler(slow_handler, owner=ClockDaemon())
+    assert len(clock.get_handler_stats()) == 2
+    assert clock.get_handler_stats()[0].calls == 4
+
+def test_handler_stats_widgets():
+    """Tests that widget instances get separate statistics until they're destroyed."""
+    clock = ClockDaemon()
+
+    class ExampleWidget:
+        """Stands in for a widget."""
+        metadata = {'id': 'org.dithernet.aspinwall.widgets.testwidget'}
+
+        def __init__(self, instance):
+            self.instance = instance
+
+    first = ExampleWidget('first')
+    second = ExampleWidget('second')
+    for widget in (first, second, second):
+        clock.call_handler(lambda: None, owner=widget)
+
+    stats = {stats.owner: stats.calls for stats in clock.get_handler_stats()}
+    assert stats == {
+        'org.dithernet.aspinwall.widgets.testwidget first': 1,
+        'org.dithernet.aspinwall.widgets.testwidget second': 2
+    }
+
+    clock.forget_owner(second)
+    assert [stats.owner for stats in clock.get_handler_stats()] == \
+        ['org.dithernet.aspinwall.widgets.testwidget first']
+
+def test_stats_interval(monkeypatch):
+    """Tests parsing the statistics interval from the environment."""
+    monkeypatch.setenv('ASPINWALL_CLOCK_STATS', '30')
+    assert get_stats_interval() == 30
+    monkeypatch.setenv('ASPINWALL_CLOCK_STATS', 'yes')
+    assert get_stats_interval() == 0
+    monkeypatch.delenv('ASPINWALL_CLOCK_STATS')
+    assert get_stats_interval() == 0
+
+def test_time_jump():
+    """Tests time jump detection."""
+    clock = ClockDaemon()
+    jumps = []
+    calls = []
+    clock.connect('time-jumped', lambda clock, jump: jumps.append(jump))
+    clock.subscribe(lambda now, elapsed: calls.append(elapsed), EVERY_DAY)
+
+    # Pretend that the wall clock was an hour behind at the last check
+    wall_time, monotonic_time = clock._reference_time
+    clock._reference_time = (wall_time - 3600, monotonic_time)
+    clock._dispatch()
+
+    assert len(jumps) == 1
+    assert jumps[0] >= 3600 - 1
+    # Repeating subscribers are updated right after the jump
+    assert len(calls) == 1
+
+def test_time_formatter():
+    """Tests the shared formatted time cache."""
+    clock = ClockDaemon()
+    formatter = TimeFormatter(clock)
+    assert formatter.format('%H:%M') == time.strftime('%H:%M')
+    assert formatter._get_entry('%H:%M') is formatter._get_entry('%H:%M')
+    assert formatter._get_entry('%A, %x').interval == EVERY_DAY
+
+    changes = []
+    watch_id = formatter.watch('%Y-%m-%d %H:%M', changes.append)
+    entry = formatter._get_entry('%Y-%m-%d %H:%M')
+    assert entry.clock_subscription
+
+    # Same minute, no change
+    now = (time.time() // 60) * 60
+    formatter._update_entry(entry, now)
+    formatter._update_entry(entry, now + 30)
+    assert len(changes) <= 1
+    # Next minute
+    changes.clear()
+    formatter._update_entry(entry, now + 60)
+    assert changes == [time.strftime('%Y-%m-%d %H:%M', time.localtime(now + 60))]
+
+    formatter.unwatch(watch_id)
+    assert not entry.clock_subscription
+    assert not clock.subscriptions
@@ -0,0 +1,123 @@
+# coding: utf-8
+"""
+Contains tests for the out-of-process image decoder.
+"""
+from gi.repository import GdkPixbuf
+import errno
+import os
+import threading
+import time
+
+from aspinwall_launcher.utils.decoder import DecoderPool
+
+def create_image(path, width=4, height=2):
+    """Saves a small PNG image at the given path."""
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, width, height)
+    pixbuf.fill(0x336699ff)
+    pixbuf.savev(str(path), 'png', [], [])
+
+def wait_until(condition, timeout=5):
+    """Waits until the condition is met or the timeout passes."""
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+def start_blocked_decode(pool, fifo_path):
+    """
+    Starts decoding a FIFO in a separate thread; the worker blocks until
+    the FIFO is opened for writing. Returns the thread and a list that
+    receives the result.
+    """
+    os.mkfifo(fifo_path)
+    result = []
+    decode_thread = threading.Thread(
+        target=lambda: result.append(pool.decode(str(fifo_path))), daemon=True
+    )
+    decode_thread.start()
+    # The worker is taken out of the pool while it's busy
+    assert wait_until(lambda: not pool.workers)
+    return (decode_thread, result)
+
+def unblock_fifo(fifo_path, timeout=5):
+    """Opens the FIFO for writing once the worker has opened it, then closes it."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            os.close(os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+            return True
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+        time.sleep(0.01)
+    return False
+
+def test_decode(tmp_path):
+    """Tests decoding an image in a worker process."""
+    create_image(tmp_path / 'image.png')
+    pool = DecoderPool(max_workers=1)
+    pool.enabled = True
+    try:
+        pixbuf, source_size = pool.decode(str(tmp_path / 'image.png'))
+        assert source_size == (4, 2)
+        assert (pixbuf.get_width(), pixbuf.get_height()) == (4, 2)
+        assert pixbuf.read_pixel_bytes().get_data()[:3] == b'\x33\x66\x99'
+
+        # Images are decoded at the size needed to cover the target area
+        pixbuf, source_size = pool.decode(str(tmp_path / 'image.png'), 8, 8, 2, upscale=True)
+        assert source_size == (4, 2)
+        assert (pixbuf.get_width(), pixbuf.get_height()) == (16, 8)
+    finally:
+        pool.shutdown()
+
+def test_decode_corrupt(tmp_path):
+    """Tests that images that can't be decoded fail without taking down the worker."""
+    (tmp_path / 'corrupt.png').write_bytes(b'not really an image')
+    pool = DecoderPool(max_workers=1)
+    pool.enabled = True
+    try:
+        assert pool.decode(str(tmp_path / 'corrupt.png')) == (None, None)
+        assert pool.decode(str(tmp_path / 'missing.png')) == (None, None)
+        assert len(pool.workers) == 1
+        assert pool.workers[0].process.poll() is None
+    finally:
+        pool.shutdown()
+
+def test_worker_crash(tmp_path):
+    """Tests that a worker dying mid-request only fails that request."""
+    create_image(tmp_path / 'image.png')
+    pool = DecoderPool(max_workers=1)
+    pool.enabled = True
+    try:
+        assert pool.decode(str(tmp_path / 'image.png'))[0]
+        worker = pool.workers[0]
+
+        decode_thread, result = start_blocked_decode(pool, tmp_path / 'fifo')
+        worker.process.kill()
+        decode_thread.join(timeout=10)
+        assert result == [(None, None)]
+
+        # A new worker is started for the next request
+        pixbuf, source_size = pool.decode(str(tmp_path / 'image.png'))
+        assert source_size == (4, 2)
+        assert pool.workers and pool.workers[0] is not worker
+    finally:
+        pool.shutdown()
+
+def test_shutdown_busy_worker(tmp_path):
+    """Tests that workers busy during a shutdown are stopped once they finish."""
+    create_image(tmp_path / 'image.png')
+    pool = DecoderPool(max_workers=1)
+    pool.enabled = True
+    assert pool.decode(str(tmp_path / 'image.png'))[0]
+    worker = pool.workers[0]
+
+    decode_thread, result = start_blocked_decode(pool, tmp_path / 'fifo')
+    pool.shutdown()
+    assert worker.process.poll() is None
+
+    assert unblock_fifo(str(tmp_path / 'fifo'))
+    decode_thread.join(timeout=10)
+    assert result
+    assert not pool.workers
+    assert worker.process.poll() is not None
@@ -0,0 +1,79 @@
+# coding: utf-8
+"""
+Contains tests for the slideshow playlist.
+"""
+from aspinwall_launcher.utils.slideshow import SlideshowPlaylist
+
+def test_sequential_order():
+    """Tests advancing through the wallpapers in order."""
+    playlist = SlideshowPlaylist(['a', 'b', 'c'])
+    assert [playlist.advance() for i in range(4)] == ['a', 'b', 'c', 'a']
+    assert playlist.cycle == 1
+
+    playlist.seek('c')
+    assert playlist.peek() == 'a'
+
+def test_shuffle_order():
+    """Tests that shuffled cycles contain every wallpaper once."""
+    playlist = SlideshowPlaylist(['a', 'b', 'c', 'd'], SlideshowPlaylist.ORDER_SHUFFLE, cycle=5)
+    assert sorted(playlist.order) == ['a', 'b', 'c', 'd']
+    # The order only depends on the cycle
+    assert playlist.order == SlideshowPlaylist(
+        ['a', 'b', 'c', 'd'], SlideshowPlaylist.ORDER_SHUFFLE, cycle=5
+    ).order
+
+def test_shuffle_ignores_weights():
+    """Tests that weights don't apply to new wallpapers in the shuffled order."""
+    playlist = SlideshowPlaylist(
+        ['a', 'b', 'c'], SlideshowPlaylist.ORDER_SHUFFLE, weights={'d': 3}
+    )
+    playlist.advance()
+    playlist.update_wallpapers(['a', 'b', 'c', 'd'])
+    assert sorted(playlist.order) == ['a', 'b', 'c', 'd']
+
+def test_weighted_order():
+    """Tests that wallpapers appear as many times per cycle as their weight."""
+    playlist = SlideshowPlaylist(
+        ['a', 'b'], SlideshowPlaylist.ORDER_WEIGHTED, weights={'a': 3}
+    )
+    assert sorted(playlist.order) == ['a', 'a', 'a', 'b']
+
+    playlist.advance()
+    playlist.update_wallpapers(['a', 'b', 'c'])
+    assert sorted(playlist.order) == ['a', 'a', 'a', 'b', 'c']
+
+def test_update_wallpapers():
+    """Tests that removing the current wallpaper continues with the next one."""
+    playlist = SlideshowPlaylist(['a', 'b', 'c'])
+    playlist.advance()
+    playlist.advance()
+    playlist.update_wallpapers(['a', 'c'])
+    assert playlist.advance() == 'c'
+
+def test_update_wallpapers_weighted_position():
+    """Tests that list changes don't rewind the weighted order to an earlier occurrence."""
+    playlist = SlideshowPlaylist(
+        ['a', 'b', 'c'], SlideshowPlaylist.ORDER_WEIGHTED, weights={'a': 3}
+    )
+    last = max(i for i, wallpaper in enumerate(playlist.order) if wallpaper == 'a')
+    rest = playlist.order[last + 1:]
+    for i in range(last + 1):
+        playlist.advance()
+
+    playlist.update_wallpapers(['a', 'b', 'c', 'd'])
+    assert playlist.position == last
+    assert playlist.current == 'a'
+    assert sorted(playlist.advance() for i in range(len(rest) + 1)) == sorted(rest + ['d'])
+
+def test_seek_position():
+    """Tests seeking to a specific occurrence of a wallpaper."""
+    playlist = SlideshowPlaylist(
+        ['a', 'b', 'c'], SlideshowPlaylist.ORDER_WEIGHTED, weights={'a': 3}
+    )
+    occurrences = [i for i, wallpaper in enumerate(playlist.order) if wallpaper == 'a']
+    playlist.seek('a', occurrences[-1])
+    assert playlist.position == occurrences[-1]
+    playlist.seek('a')
+    assert playlist.position == occurrences[0]
+    playlist.seek('d', 2)
+    assert playlist.position == -1
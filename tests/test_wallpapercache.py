@@ -0,0 +1,118 @@
+# coding: utf-8
+"""
+Contains tests for the wallpaper cache.
+"""
+import gi
+gi.require_version('Gdk', '4.0')
+from gi.repository import Gdk, GdkPixbuf
+import os
+
+from aspinwall_launcher.utils.wallpapercache import WallpaperCache, WallpaperMemoryCache
+
+def create_pixbuf(width, height, color=0x336699ff):
+    """Returns a pixbuf filled with the given color."""
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, width, height)
+    pixbuf.fill(color)
+    return pixbuf
+
+def test_wallpaper_cache_roundtrip(tmp_path):
+    """Tests storing and looking up rendered wallpapers."""
+    source = tmp_path / 'wallpaper.png'
+    source.write_bytes(b'not really an image')
+    cache = WallpaperCache(path=str(tmp_path / 'cache'), max_size=1024 * 1024)
+
+    key = cache.get_key(str(source), 64, 32, 2)
+    assert cache.lookup(key) is None
+
+    cache.store(key, create_pixbuf(64, 32), (640, 320))
+    texture, source_size = cache.lookup(key)
+    assert texture.get_width() == 64
+    assert texture.get_height() == 32
+    assert source_size == (640, 320)
+
+    # Other sizes and styles, or a modified source, use different entries
+    assert cache.get_key(str(source), 32, 32, 2) != key
+    assert cache.get_key(str(source), 64, 32, 1) != key
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert cache.get_key(str(source), 64, 32, 2) != key
+
+    assert cache.get_key(str(tmp_path / 'missing.png'), 64, 32, 2) is None
+
+def test_wallpaper_cache_eviction(tmp_path):
+    """Tests that least recently used entries are evicted first."""
+    entry_size = 64 * 64 * 3
+    cache = WallpaperCache(path=str(tmp_path), max_size=entry_size * 2 + 1024)
+
+    cache.store('first', create_pixbuf(64, 64), (64, 64))
+    cache.store('second', create_pixbuf(64, 64), (64, 64))
+    os.utime(cache.get_entry_path('first'), (1, 1))
+    os.utime(cache.get_entry_path('second'), (2, 2))
+    assert cache.lookup('first')  # marks the entry as recently used
+
+    cache.store('third', create_pixbuf(64, 64), (64, 64))
+    assert cache.lookup('second') is None
+    assert cache.lookup('first')
+    assert cache.lookup('third')
+
+def test_wallpaper_cache_corrupt_entry(tmp_path):
+    """Tests that corrupt entries are ignored and removed."""
+    cache = WallpaperCache(path=str(tmp_path), max_size=1024 * 1024)
+    with open(cache.get_entry_path('corrupt'), 'wb') as entry:
+        entry.write(b'AWPC')
+
+    assert cache.lookup('corrupt') is None
+    assert not os.path.exists(cache.get_entry_path('corrupt'))
+
+def test_wallpaper_memory_cache():
+    """Tests loading, sharing and evicting in-memory wallpapers."""
+    pixbuf = create_pixbuf(64, 64)
+    entry = (pixbuf, (64, 64), Gdk.Texture.new_for_pixbuf(pixbuf))
+    entry_size = pixbuf.get_byte_length() + 64 * 64 * 4
+    cache = WallpaperMemoryCache(max_size=entry_size * 2)
+
+    loads = []
+
+    def load():
+        """Counts loads."""
+        loads.append(True)
+        return entry
+
+    assert cache.get('first', load) is entry
+    assert cache.get('first', load) is entry
+    assert len(loads) == 1
+
+    cache.get('second', load)
+    cache.lookup('first')  # marks the entry as recently used
+    cache.get('third', load)
+    assert cache.lookup('second') is None
+    assert cache.lookup('first') is entry
+    assert cache.total_size == entry_size * 2
+
+    # Failed loads aren't cached
+    assert cache.get('failed', lambda: (None, None, None)) == (None, None, None)
+    assert cache.lookup('failed') is None
+
+    cache.set_max_size(0)
+    assert not cache.entries
+
+def test_wallpaper_memory_cache_remove():
+    """Tests that removed entries (like those of released wallpapers) free their memory."""
+    pixbuf = create_pixbuf(64, 64)
+    entry = (pixbuf, (64, 64), Gdk.Texture.new_for_pixbuf(pixbuf))
+    entry_size = pixbuf.get_byte_length() + 64 * 64 * 4
+    cache = WallpaperMemoryCache(max_size=entry_size * 4)
+
+    key = cache.get_key('/missing.png', 64, 64, 2)
+    preview_key = cache.get_key('/missing.png', 64, 64, 2, True)
+    cache.get(key, lambda: entry)
+    cache.get(preview_key, lambda: entry)
+
+    cache.remove(key)
+    assert cache.lookup(key) is None
+    assert cache.lookup(preview_key) is entry
+    assert cache.total_size == entry_size
+
+    # Removing entries that aren't cached does nothing
+    cache.remove(key)
+    assert cache.total_size == entry_size
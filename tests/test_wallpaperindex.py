@@ -0,0 +1,80 @@
+# coding: utf-8
+"""
+Contains tests for the wallpaper index.
+"""
+from gi.repository import GdkPixbuf
+import os
+
+from aspinwall_launcher.utils.wallpaperindex import WallpaperIndex, scan_paths
+
+def create_image(path, width=32, height=16):
+    """Saves a small PNG image at the given path."""
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, width, height)
+    pixbuf.fill(0x336699ff)
+    pixbuf.savev(str(path), 'png', [], [])
+
+def test_scan_paths(tmp_path):
+    """Tests indexing wallpapers in nested directories."""
+    (tmp_path / 'nested').mkdir()
+    create_image(tmp_path / 'first.png')
+    create_image(tmp_path / 'nested' / 'second.png', 64, 32)
+    (tmp_path / 'broken.jpg').write_bytes(b'not really an image')
+    (tmp_path / 'notes.txt').write_bytes(b'not a wallpaper')
+
+    files, directories = scan_paths([str(tmp_path)], {})
+    assert directories == {str(tmp_path), str(tmp_path / 'nested')}
+    assert sorted(files) == [
+        str(tmp_path / 'broken.jpg'), str(tmp_path / 'first.png'),
+        str(tmp_path / 'nested' / 'second.png')
+    ]
+    assert files[str(tmp_path / 'nested' / 'second.png')][1:] == [64, 32, 'png']
+    assert files[str(tmp_path / 'broken.jpg')][3] is None
+
+    # Unchanged files aren't probed again
+    known = {str(tmp_path / 'first.png'): files[str(tmp_path / 'first.png')][:1] + [1, 1, 'png']}
+    files, directories = scan_paths([str(tmp_path)], known)
+    assert files[str(tmp_path / 'first.png')][1:] == [1, 1, 'png']
+
+def test_apply_scan(tmp_path):
+    """Tests announcing added and removed wallpapers."""
+    index = WallpaperIndex(path=str(tmp_path / 'index.json'))
+    wallpapers_dir = tmp_path / 'wallpapers'
+    wallpapers_dir.mkdir()
+    create_image(wallpapers_dir / 'first.png')
+
+    added = []
+    removed = []
+    index.connect('wallpapers-added', lambda index, paths: added.extend(paths))
+    index.connect('wallpapers-removed', lambda index, paths: removed.extend(paths))
+
+    index.apply_scan([str(wallpapers_dir)], *scan_paths([str(wallpapers_dir)], {}))
+    assert added == [str(wallpapers_dir / 'first.png')]
+    assert index.get_wallpapers() == added
+    assert str(wallpapers_dir) in index.monitors
+
+    os.unlink(wallpapers_dir / 'first.png')
+    index.apply_scan([str(wallpapers_dir / 'first.png')], {}, set())
+    assert removed == [str(wallpapers_dir / 'first.png')]
+    assert not index.get_wallpapers()
+
+def test_set_directories_during_scan(tmp_path):
+    """Tests that directories added before the initial scan finishes are indexed."""
+    index = WallpaperIndex(path=str(tmp_path / 'index.json'))
+    first_dir = tmp_path / 'first'
+    second_dir = tmp_path / 'second'
+    first_dir.mkdir()
+    second_dir.mkdir()
+    create_image(first_dir / 'first.png')
+
+    queued = []
+    index.queue_update = queued.extend
+    index.directories = [str(first_dir)]
+    index.set_directories([str(first_dir), str(second_dir)])
+    assert not queued
+
+    index._finish_start(
+        None, [str(first_dir)], *scan_paths([str(first_dir)], {}), False
+    )
+    assert index.directories == [str(first_dir), str(second_dir)]
+    assert queued == [str(second_dir)]
+    assert index.get_wallpapers() == [str(first_dir / 'first.png')]
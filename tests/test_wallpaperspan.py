@@ -0,0 +1,53 @@
+# coding: utf-8
+"""
+Contains tests for the geometry of wallpapers spanned across monitors.
+"""
+from aspinwall_launcher.utils.wallpaperspan import (
+    get_monitor_span, get_span_crop, get_span_source_size
+)
+
+def test_monitor_span():
+    """Tests describing monitors in layouts with mixed sizes and offsets."""
+    # A 1920x1080 monitor to the left of a taller 1440x2560 monitor,
+    # with the layout not starting at the origin
+    geometries = [(-1920, 200, 1920, 1080), (0, 0, 1440, 2560)]
+    span = get_monitor_span(geometries, geometries[0], [1, 2])
+    assert span == (3360, 2560, 0, 200, 1920, 1080, 2)
+    span = get_monitor_span(geometries, geometries[1], [1, 2])
+    assert span == (3360, 2560, 1920, 0, 1440, 2560, 2)
+
+    # The image is decoded for the highest (possibly fractional) scale
+    span = get_monitor_span(geometries, geometries[0], [1, 1.25])
+    assert get_span_source_size(span) == (4200, 3200)
+
+def test_span_crop_side_by_side():
+    """Tests cropping an image that exactly covers two monitors."""
+    geometries = [(0, 0, 1920, 1080), (1920, 0, 1920, 1080)]
+    left = get_monitor_span(geometries, geometries[0], [1, 1])
+    right = get_monitor_span(geometries, geometries[1], [1, 1])
+    assert get_span_crop(3840, 1080, left) == (0, 0, 1920, 1080)
+    assert get_span_crop(3840, 1080, right) == (1920, 0, 1920, 1080)
+
+    # Images decoded at a higher scale are cropped proportionally
+    assert get_span_crop(7680, 2160, right) == (3840, 0, 3840, 2160)
+
+def test_span_crop_zoomed():
+    """Tests cropping an image that has to be zoomed to cover the layout."""
+    geometries = [(0, 0, 1920, 1080), (1920, 0, 1920, 1080)]
+    right = get_monitor_span(geometries, geometries[1], [1, 1])
+    # A 16:9 image is zoomed 2x; the top and bottom quarters are cut off
+    assert get_span_crop(1920, 1080, right) == (960, 270, 960, 540)
+
+def test_span_crop_mixed_sizes():
+    """Tests cropping for monitors of different sizes and offsets."""
+    geometries = [(0, 440, 1920, 1080), (1920, 0, 1440, 2560)]
+    small = get_monitor_span(geometries, geometries[0], [1, 1])
+    tall = get_monitor_span(geometries, geometries[1], [1, 1])
+    assert get_span_crop(3360, 2560, small) == (0, 440, 1920, 1080)
+    assert get_span_crop(3360, 2560, tall) == (1920, 0, 1440, 2560)
+
+    # Crops never leave the image
+    for span in (small, tall):
+        x, y, width, height = get_span_crop(1000, 500, span)
+        assert 0 <= x and x + width <= 1000
+        assert 0 <= y and y + height <= 500
@@ -3,28 +3,85 @@
 World clock widget for Aspinwall
 """
 from aspinwall_launcher.widgets import Widget
-from aspinwall_launcher.utils.clock import clock_daemon
+from aspinwall_launcher.utils.clock import clock_daemon, time_formatter, EVERY_MINUTE
 import gi
 gi.require_version('GWeather', '4.0')
 from gi.repository import Adw, GLib, Gtk, GWeather
 translatable = lambda message: message
 import gettext
+import time
+
+# How far ahead to look for timezone transitions (in seconds)
+TRANSITION_SEARCH_RANGE = 366 * 24 * 60 * 60
+
+# Timezone offsets, keyed by timezone identifier (None for the local
+# timezone). Each entry contains the offset and the time range in which
+# it stays valid: from the time it was looked up until the next transition.
+_offset_cache = {}
+_local_timezone = None
+
+def get_local_timezone():
+    """Returns the (cached) local timezone."""
+    global _local_timezone
+    if not _local_timezone:
+        _local_timezone = GLib.TimeZone.new_local()
+    return _local_timezone
+
+def on_timezone_changed(clock, timezone_name):
+    """Drops the cached local timezone and its offset."""
+    global _local_timezone
+    _local_timezone = None
+    if timezone_name:
+        _local_timezone = GLib.TimeZone.new_identifier(timezone_name)
+    _offset_cache.pop(None, None)
+
+clock_daemon.connect('timezone-changed', on_timezone_changed)
+
+def find_next_transition(timezone, interval, now):
+    """
+    Returns the time of the first transition to another interval after
+    the given time, or the end of the search range if there is none.
+    """
+    low = now
+    high = now + TRANSITION_SEARCH_RANGE
+    if timezone.find_interval(GLib.TimeType.UNIVERSAL, high) == interval:
+        return high
+
+    # Binary search for the first second in the next interval
+    while high - low > 1:
+        middle = (low + high) // 2
+        if timezone.find_interval(GLib.TimeType.UNIVERSAL, middle) == interval:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def get_cached_offset(timezone, key):
+    """
+    Returns the current UTC offset of the timezone, using the cached value
+    for the given key if it is still valid.
+    """
+    now = int(time.time())
+    cached = _offset_cache.get(key)
+    if cached and cached[1] <= now < cached[2]:
+        return cached[0]
+
+    interval = timezone.find_interval(GLib.TimeType.UNIVERSAL, now)
+    offset = timezone.get_offset(interval)
+    _offset_cache[key] = (offset, now, find_next_transition(timezone, interval, now))
+    return offset
 
 def get_timezone_offset(timezone, use_local=False):
     """
     Convenience function to get an int representing the timezone offset
     compared to the UTC or local timezone, depending on the value of the
     use_local parameter.
+
+    Offsets are cached until the next DST transition in the timezone.
     """
-    interval = timezone.find_interval(
-        GLib.TimeType.UNIVERSAL,
-        GLib.DateTime.new_now(timezone).to_unix()
-    )
-    offset = timezone.get_offset(interval)
+    offset = get_cached_offset(timezone, timezone.get_identifier())
     if use_local:
-        utc_offset = offset
-        local_offset = get_timezone_offset(GLib.TimeZone.new_local())
-        offset = utc_offset - local_offset
+        offset -= get_cached_offset(get_local_timezone(), None)
     return offset
 
 class WorldClock(Widget):
@@ -47,17 +104,8 @@ class WorldClock(Widget):
 
     def __init__(self, instance):
         super().__init__(instance)
-        _ = self.l
 
-        self.location = None
-        if self.config['location']:
-            # We get it this way to prevent PyGObject from turning it
-            # into a Python object (it has to be a GVariant)
-            location_variant = self.config.get_value('location').\
-                                get_child_value(0).get_child_value(0)
-            self.location = GWeather.Location.get_world().deserialize(
-                location_variant
-            )
+        self.locations = self.load_locations()
 
         self.content = Gtk.Box(
             orientation=Gtk.Orientation.VERTICAL,
@@ -67,6 +115,7 @@ class WorldClock(Widget):
         )
         self.content.add_css_class('container')
 
+        # Single location layout
         self.clock_label = Gtk.Label(label='00:00')
         self.clock_label.add_css_class('clock')
         self.clock_label.add_css_class('numeric')
@@ -77,8 +126,18 @@ class WorldClock(Widget):
         self.timezone_label.add_css_class('timezone-label')
         self.content.append(self.timezone_label)
 
-        clock_daemon.connect('notify::time', self.update)
-        self.update()
+        # Multiple location layout
+        self.city_list = Gtk.Grid(column_spacing=18, row_spacing=6)
+        self.city_list.add_css_class('city-list')
+        self.content.append(self.city_list)
+
+        # Contains (location, time label, offset label, offset prefix) tuples
+        self.city_rows = []
+        self.build_city_list()
+
+        # All locations are updated from a single subscription
+        self.clock_subscription = clock_daemon.subscribe(self.update, EVERY_MINUTE, owner=self)
+        self.config.connect('changed::twelvehour-time', self.update)
 
         self.set_child(self.content)
 
@@ -86,37 +145,120 @@ class WorldClock(Widget):
         from .settings import ClockSettings
         self.set_settings_child(ClockSettings(self))
 
-    def update(self, *args):
-        """Updates the clock data every second."""
-        _ = self.l
-        if not self.location:
-            self.timezone_label.set_label(
-                _('No location selected. Open the widget settings and choose a location.')
+    def destroy(self):
+        """Stops the clock updates and cleans up after the widget."""
+        clock_daemon.unsubscribe(self.clock_subscription)
+        super().destroy()
+
+    def load_locations(self):
+        """Returns the list of locations stored in the config."""
+        # Migrate configs from before multiple locations were supported
+        if not self.config['locations'] and self.config['location']:
+            self.config.set_value('locations', self.config.get_value('location'))
+            self.config.reset('location')
+
+        world = GWeather.Location.get_world()
+        locations = []
+        locations_variant = self.config.get_value('locations')
+        for i in range(locations_variant.n_children()):
+            # We get it this way to prevent PyGObject from turning it
+            # into a Python object (it has to be a GVariant)
+            location = world.deserialize(
+                locations_variant.get_child_value(i).get_child_value(0)
             )
+            if location:
+                locations.append(location)
+        return locations
+
+    def set_locations(self, locations):
+        """Sets the list of displayed locations and saves it to the config."""
+        self.locations = locations
+        self.config['locations'] = [location.serialize() for location in locations]
+        self.build_city_list()
+
+    def build_city_list(self):
+        """Sets up the clock labels for the current list of locations."""
+        self.city_rows = []
+        child = self.city_list.get_first_child()
+        while child:
+            next_child = child.get_next_sibling()
+            self.city_list.remove(child)
+            child = next_child
+
+        multiple = len(self.locations) > 1
+        self.clock_label.set_visible(not multiple)
+        self.timezone_label.set_visible(not multiple)
+        self.city_list.set_visible(multiple)
+
+        if not multiple:
+            if self.locations:
+                location = self.locations[0]
+                self.city_rows.append((
+                    location, self.clock_label, self.timezone_label,
+                    f'{location.get_name()} • '
+                ))
+            self.update()
             return
-        time = GLib.DateTime.new_now(self.location.get_timezone())
-        if self.config['twelvehour-time']:
-            time_string = time.format('%I:%M %p')
-        else:
-            time_string = time.format('%H:%M')
-        self.clock_label.set_label(time_string)
 
-        timezone_offset_hour = int(
-            get_timezone_offset(self.location.get_timezone(), use_local=True) / 3600
-        )
+        for row, location in enumerate(self.locations):
+            name_label = Gtk.Label(label=location.get_name(), xalign=0)
+            name_label.add_css_class('city-name')
+            self.city_list.attach(name_label, 0, row, 1, 1)
+
+            offset_label = Gtk.Label(xalign=0, hexpand=True)
+            offset_label.add_css_class('dim-label')
+            offset_label.add_css_class('timezone-label')
+            self.city_list.attach(offset_label, 1, row, 1, 1)
+
+            time_label = Gtk.Label(xalign=1)
+            time_label.add_css_class('city-time')
+            time_label.add_css_class('numeric')
+            self.city_list.attach(time_label, 2, row, 1, 1)
+
+            self.city_rows.append((location, time_label, offset_label, ''))
+        self.update()
+
+    def get_offset_text(self, timezone):
+        """Returns a description of the timezone's offset from local time."""
+        _ = self.l
+        timezone_offset_hour = int(get_timezone_offset(timezone, use_local=True) / 3600)
         if timezone_offset_hour > 0:
-            timezone_offset_text = gettext.ngettext(
+            return gettext.ngettext(
                 '{n} hour later', '{n} hours later',
                 timezone_offset_hour
             ).format(n=timezone_offset_hour)
         elif timezone_offset_hour < 0:
-            timezone_offset_text = gettext.ngettext(
+            return gettext.ngettext(
                 '{n} hour earlier', '{n} hours earlier',
                 timezone_offset_hour * -1
             ).format(n=timezone_offset_hour * -1)
-        else: # timezone_offset_hour == 0
-            timezone_offset_text = _('Same as local time')
+        # timezone_offset_hour == 0
+        return _('Same as local time')
+
+    def update(self, *args):
+        """Updates the clock data for all locations every minute."""
+        _ = self.l
+        if not self.locations:
+            self.timezone_label.set_label(
+                _('No location selected. Open the widget settings and choose a location.')
+            )
+            return
+
+        if self.config['twelvehour-time']:
+            time_format = '%I:%M %p'
+        else:
+            time_format = '%H:%M'
+
+        # Gather all new strings first, then only touch labels that changed
+        updates = []
+        for location, time_label, offset_label, offset_prefix in self.city_rows:
+            timezone = location.get_timezone()
+            # The formatted time is shared between all clocks in the same timezone
+            updates.append((time_label, time_formatter.format(time_format, timezone)))
+            updates.append((offset_label, offset_prefix + self.get_offset_text(timezone)))
 
-        self.timezone_label.set_label(f'{self.location.get_name()} • {timezone_offset_text}')
+        for label, text in updates:
+            if label.get_label() != text:
+                label.set_label(text)
 
 _widget_class = WorldClock
@@ -1,11 +1,47 @@
 from gi.repository import Adw, Gtk, GWeather, Gio
 
+# List of all cities and named timezones. This is shared between all world
+# clocks, and only built once a location selector is first opened.
+_locations_store = None
+
+def get_locations_store():
+    """Returns a ListStore containing all cities and named timezones."""
+    global _locations_store
+    if _locations_store is not None:
+        return _locations_store
+
+    # Get world; this will allow us to iterate over all available locations
+    world = GWeather.Location.get_world()
+
+    # Create ListStore for city locations
+    _locations_store = Gio.ListStore(item_type=GWeather.Location)
+
+    # This loop iterates over all existing locations to find cities and named timezones
+    # only.
+    valid_levels = (GWeather.LocationLevel.CITY, GWeather.LocationLevel.NAMED_TIMEZONE)
+    prev_loc_buffer = [world]
+    loc_buffer = []
+    while prev_loc_buffer:
+        for child in prev_loc_buffer:
+            iter_prev = None
+            iter_location = child.next_child(None)
+            while iter_location:
+                loc_buffer.append(iter_location)
+                iter_prev = iter_location
+                iter_location = child.next_child(iter_prev)
+            if child.get_level() in valid_levels:
+                _locations_store.append(child)
+        prev_loc_buffer = loc_buffer
+        loc_buffer = []
+    return _locations_store
+
 @Gtk.Template(resource_path='/org/dithernet/aspinwall/widgets/WorldClock/ui/settings.ui')
 class ClockSettings(Gtk.Box):
     __gtype_name__ = 'ClockSettings'
 
     settings_stack = Gtk.Template.Child()
     preferences = Gtk.Template.Child()
+    selected_locations_list = Gtk.Template.Child()
     location_selector = Gtk.Template.Child()
 
     location_list_box = Gtk.Template.Child()
@@ -18,17 +54,12 @@ class ClockSettings(Gtk.Box):
         super().__init__()
         self._parent = parent
         self._initialized = False
-        self.active_selection_box = None
-        self._ignore_sb_active_change = False
 
-        self.populate_locations_store()
+        # Set up when the location selector is first opened
+        self.settings_filter = None
+        self.settings_filterlist = None
 
-        self.settings_filter = Gtk.CustomFilter.new(self.location_filterfunc, None)
-        self.settings_filterlist = Gtk.FilterListModel.new(
-            self.locations_store,
-            self.settings_filter
-        )
-        self.location_list_box.bind_model(self.settings_filterlist, self.location_bind)
+        self.update_selected_locations()
 
         self._parent.config.bind('twelvehour-time', self.twelvehour_time_checkbutton, 'active',
             Gio.SettingsBindFlags.DEFAULT
@@ -42,31 +73,6 @@ class ClockSettings(Gtk.Box):
         if widget._settings_toggled:
             self.close_location_selector()
 
-    def populate_locations_store(self):
-        # Get world; this will allow us to iterate over all available locations
-        world = GWeather.Location.get_world()
-
-        # Create ListStore for city locations
-        self.locations_store = Gio.ListStore(item_type=GWeather.Location)
-
-        # This loop iterates over all existing locations to find cities and named timezones
-        # only.
-        valid_levels = (GWeather.LocationLevel.CITY, GWeather.LocationLevel.NAMED_TIMEZONE)
-        prev_loc_buffer = [world]
-        loc_buffer = []
-        while prev_loc_buffer:
-            for child in prev_loc_buffer:
-                iter_prev = None
-                iter_location = child.next_child(None)
-                while iter_location:
-                    loc_buffer.append(iter_location)
-                    iter_prev = iter_location
-                    iter_location = child.next_child(iter_prev)
-                if child.get_level() in valid_levels:
-                    self.locations_store.append(child)
-            prev_loc_buffer = loc_buffer
-            loc_buffer = []
-
     def location_bind(self, item):
         """Binds the list items in the app list."""
         row = Adw.ActionRow(
@@ -79,30 +85,72 @@ class ClockSettings(Gtk.Box):
         selection_box.add_css_class('selection-mode')
         row.add_suffix(selection_box)
         row.set_activatable_widget(selection_box)
-        if self._parent.location and item == self._parent.location:
-            selection_box.set_active(True)
-            self.active_selection_box = selection_box
+        for location in self._parent.locations:
+            if item.equal(location):
+                selection_box.set_active(True)
+                break
         selection_box.connect('toggled', self.location_update_selection, item)
         return row
 
     def location_update_selection(self, selection_box, item):
-        if self._ignore_sb_active_change:
-            return
-
-        if selection_box.get_active() is False:
-            self._ignore_sb_active_change = True
-            selection_box.set_active(True)
-            self._ignore_sb_active_change = False
-            return
-
-        if self.active_selection_box:
-            self._ignore_sb_active_change = True
-            self.active_selection_box.set_active(False)
-            self._ignore_sb_active_change = False
-        self.active_selection_box = selection_box
-
-        self._parent.location = item
-        self._parent.config['location'] = (item.serialize(),)
+        """Adds/removes the location from the displayed locations."""
+        locations = [
+            location for location in self._parent.locations if not item.equal(location)
+        ]
+        if selection_box.get_active():
+            locations.append(item)
+        self._parent.set_locations(locations)
+        self.update_selected_locations()
+
+    def update_selected_locations(self):
+        """Fills the list of displayed locations."""
+        row = self.selected_locations_list.get_row_at_index(0)
+        while row:
+            self.selected_locations_list.remove(row)
+            row = self.selected_locations_list.get_row_at_index(0)
+
+        for index, location in enumerate(self._parent.locations):
+            row = Adw.ActionRow(
+                title=location.get_name(),
+                subtitle=location.get_timezone_str()
+            )
+
+            move_up_button = Gtk.Button(
+                icon_name='go-up-symbolic',
+                valign=Gtk.Align.CENTER,
+                sensitive=index > 0
+            )
+            move_up_button.add_css_class('flat')
+            move_up_button.connect('clicked', self.move_location_up, index)
+            row.add_suffix(move_up_button)
+
+            remove_button = Gtk.Button(
+                icon_name='list-remove-symbolic',
+                valign=Gtk.Align.CENTER
+            )
+            remove_button.add_css_class('flat')
+            remove_button.connect('clicked', self.remove_location, index)
+            row.add_suffix(remove_button)
+
+            self.selected_locations_list.append(row)
+
+        self.selected_locations_list.set_visible(bool(self._parent.locations))
+
+    def move_location_up(self, button, index):
+        """Moves the location at the given index one position up."""
+        locations = self._parent.locations.copy()
+        locations.insert(index - 1, locations.pop(index))
+        self._parent.set_locations(locations)
+        self.update_selected_locations()
+
+    def remove_location(self, button, index):
+        """Removes the location at the given index."""
+        locations = self._parent.locations.copy()
+        locations.pop(index)
+        self._parent.set_locations(locations)
+        self.update_selected_locations()
+        if self.settings_filter:
+            self.settings_filter.changed(Gtk.FilterChange.DIFFERENT)
 
     @Gtk.Template.Callback()
     def location_update_search(self, *args):
@@ -125,6 +173,13 @@ class ClockSettings(Gtk.Box):
 
     @Gtk.Template.Callback()
     def open_location_selector(self, *args):
+        if not self.settings_filter:
+            self.settings_filter = Gtk.CustomFilter.new(self.location_filterfunc, None)
+            self.settings_filterlist = Gtk.FilterListModel.new(
+                get_locations_store(),
+                self.settings_filter
+            )
+            self.location_list_box.bind_model(self.settings_filterlist, self.location_bind)
         self.settings_stack.set_visible_child(self.location_selector)
 
     @Gtk.Template.Callback()